@@ -0,0 +1,64 @@
+"""Run several API workers with maze-affinity routing.
+
+Usage:
+    python cluster.py [--workers 4] [--host 0.0.0.0] [--porta 8001] [--url-publica ws://localhost]
+
+Worker i listens on --porta + i. Every worker gets the same WORKERS_ROTEAMENTO
+list and its own WORKER_ID, so they all agree on which worker owns each maze:
+/generate-websocket/ on any of them returns the owner's URL, and websockets
+opened on the wrong worker are answered with a redirect hint. The schema is
+migrated once here, before the workers start. Extra environment variables
+(ROTEAMENTO_CHAVE, DATABASE_URL, ...) are passed through to the workers.
+Stopping the launcher sends SIGTERM to every worker, which drains its sessions
+(see DESLIGAMENTO_PRAZO) before exiting.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Inicia um worker da API por núcleo com roteamento por labirinto.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=8001, help="porta do primeiro worker")
+    parser.add_argument("--url-publica", default="ws://localhost", help="esquema e host usados nas URLs de websocket")
+    args = parser.parse_args()
+
+    portas = [args.porta + i for i in range(args.workers)]
+    ambiente = dict(os.environ)
+    ambiente["WORKERS_ROTEAMENTO"] = ",".join(f"{args.url_publica}:{porta}" for porta in portas)
+    ambiente["MIGRAR_NA_INICIALIZACAO"] = "0"
+
+    subprocess.run([sys.executable, "main.py", "migrar"], cwd=DIRETORIO, env=ambiente, check=True)
+
+    processos = []
+    for worker_id, porta in enumerate(portas):
+        processos.append(subprocess.Popen(
+            [sys.executable, "main.py", "--host", args.host, "--porta", str(porta)],
+            cwd=DIRETORIO,
+            env={**ambiente, "WORKER_ID": str(worker_id)}
+        ))
+        print(f"worker {worker_id} em {args.url_publica}:{porta}")
+
+    # SIGTERM on the launcher goes through the same cleanup as Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for processo in processos:
+            processo.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for processo in processos:
+            if processo.poll() is None:
+                processo.send_signal(signal.SIGTERM)
+        for processo in processos:
+            processo.wait()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,11 +1,32 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
 from uuid import UUID
 import uuid
 import asyncio
 import datetime
-from sqlalchemy import create_engine, Column, Integer, Float, String, ForeignKey, UUID as SQLUUID
+import json
+import os
+import time
+import hashlib
+import mmap
+import struct
+import sys
+import heapq
+import math
+import random
+import orjson
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, func, insert, update, select, inspect, text, case, tuple_, literal, and_, or_, Column, Integer, Float, String, Boolean, LargeBinary, ForeignKey, UUID as SQLUUID
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.schema import PrimaryKeyConstraint
@@ -18,14 +39,75 @@ class MovementHistory(Base):
     __tablename__ = 'movement_history'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(Integer, ForeignKey('sessoes_websocket.id'))
+    session_id = Column(Integer, ForeignKey('sessoes_websocket.id'), index=True)
     labirinto_id = Column(Integer, ForeignKey('labirintos.id'))
     grupo_id = Column(SQLUUID(as_uuid=True), ForeignKey('grupos.id'))
-    vertex_sequence = Column(String)  # Store as comma-separated string
+    vertex_sequence = Column(String)  # Legacy comma-separated format, emptied by migrar_banco
     timestamp = Column(String)
+    move_count = Column(Integer, default=0)  # Number of vertices stored in the chunks
+    ultimo_vertice = Column(Integer)  # Base for the next delta when appending
+    ultimo_instante = Column(Integer)  # Same, for the move times (Unix ms)
+    # Written by the bulk re-grading job (recorrigir_historicos)
+    valido = Column(Boolean)
+    chegou_saida = Column(Boolean)
+    custo = Column(Integer)
+    otimo = Column(Boolean)
+    corrigido_em = Column(String)
 
     session = relationship("SessaoWebSocket", backref="movement_history")
 
+class MovementChunk(Base):
+    __tablename__ = 'movement_chunks'
+
+    # Up to CHUNK_MOVIMENTOS vertices, zigzag delta + varint encoded against `base`
+    history_id = Column(Integer, ForeignKey('movement_history.id'), nullable=False)
+    indice = Column(Integer, nullable=False)
+    base = Column(Integer, nullable=False)
+    quantidade = Column(Integer, nullable=False)
+    dados = Column(LargeBinary, nullable=False)
+    # Move times in Unix ms, encoded the same way against `tempo_base`; NULL on chunks written before timing
+    tempo_base = Column(Integer)
+    tempos = Column(LargeBinary)
+
+    __table_args__ = (PrimaryKeyConstraint('history_id', 'indice', name='pk_movement_chunk'),)
+
+class MovementLog(Base):
+    __tablename__ = 'movement_log'
+
+    # Recent moves only, read incrementally by live feeds; pruned after LOG_RETENCAO seconds
+    # because the chunks are the permanent record (vertices and times)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(Integer, ForeignKey('sessoes_websocket.id'))
+    labirinto_id = Column(Integer, ForeignKey('labirintos.id'), index=True)
+    passo = Column(Integer)
+    vertice_id = Column(Integer)
+    instante = Column(Integer)  # Unix ms
+
+class HeatmapVertice(Base):
+    __tablename__ = 'heatmap_vertices'
+
+    # Arrivals at a vertex, per group and hour bucket; maintained by HeatmapBuffer
+    labirinto_id = Column(Integer, ForeignKey('labirintos.id'), nullable=False)
+    grupo_id = Column(SQLUUID(as_uuid=True), ForeignKey('grupos.id'), nullable=False)
+    periodo = Column(String, nullable=False)  # Hour bucket, e.g. "2024-05-01T14"
+    vertice_id = Column(Integer, nullable=False)
+    visitas = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (PrimaryKeyConstraint('labirinto_id', 'grupo_id', 'periodo', 'vertice_id', name='pk_heatmap_vertice'),)
+
+class HeatmapAresta(Base):
+    __tablename__ = 'heatmap_arestas'
+
+    # Moves along an edge, per group and hour bucket; maintained by HeatmapBuffer
+    labirinto_id = Column(Integer, ForeignKey('labirintos.id'), nullable=False)
+    grupo_id = Column(SQLUUID(as_uuid=True), ForeignKey('grupos.id'), nullable=False)
+    periodo = Column(String, nullable=False)
+    origem_id = Column(Integer, nullable=False)
+    destino_id = Column(Integer, nullable=False)
+    transicoes = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (PrimaryKeyConstraint('labirinto_id', 'grupo_id', 'periodo', 'origem_id', 'destino_id', name='pk_heatmap_aresta'),)
+
 class Aresta(Base):
     __tablename__ = 'arestas'
 
@@ -60,6 +142,7 @@ class Labirinto(Base):
     entrada = Column(Integer)
     saida = Column(String)
     dificuldade = Column(String)
+    versao = Column(Integer, default=1)  # Bumped by every PATCH to the maze
 
     info_grupos = relationship("InfoGrupo", back_populates="labirinto")
 
@@ -79,6 +162,8 @@ class InfoGrupo(Base):
     labirinto_id = Column(Integer, ForeignKey('labirintos.id'), nullable=False)
     passos = Column(Integer)
     exploracao = Column(Float)
+    concluido = Column(Boolean, default=False)
+    consultas_visao = Column(Integer, default=0)  # "ver:<k>" commands, accounted apart from passos
 
     __table_args__ = (PrimaryKeyConstraint('grupo_id', 'labirinto_id', name='pk_info'),)
 
@@ -91,9 +176,43 @@ class SessaoWebSocket(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     grupo_id = Column(SQLUUID, ForeignKey('grupos.id'))
     conexao = Column(String)
+    estado = Column(String, index=True)  # criada, ativa, desconectada, expirada
+    criada_em = Column(String)
+    atualizada_em = Column(String)  # Last state change; expiry is measured from here
 
     grupo = relationship("Grupo", back_populates="sessoes_websocket")
 
+class SessaoArquivada(Base):
+    __tablename__ = 'sessoes_arquivadas'
+
+    # Expired sessions moved out of sessoes_websocket by compactar_sessoes; histories keep their session_id
+    id = Column(Integer, primary_key=True)
+    grupo_id = Column(SQLUUID, ForeignKey('grupos.id'))
+    conexao = Column(String)
+    criada_em = Column(String)
+    atualizada_em = Column(String)
+    arquivada_em = Column(String)
+
+class VersaoCache(Base):
+    __tablename__ = 'versoes_cache'
+
+    # Invalidation counters shared by the workers of a cluster
+    entidade = Column(String, primary_key=True)
+    versao = Column(Integer, nullable=False)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(String, primary_key=True)
+    tipo = Column(String)
+    parametros = Column(String)  # JSON
+    estado = Column(String, index=True)  # pendente, executando, concluido, falhou
+    progresso = Column(Float)
+    resultado = Column(String)  # JSON
+    erro = Column(String)
+    criado_em = Column(String)
+    atualizado_em = Column(String)
+
 # Pydantic models
 class VerticeModel(BaseModel):
     id: int
@@ -130,8 +249,7 @@ class GrupoDto(BaseModel):
     nome: str
     labirintos_concluidos: Optional[List[int]]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class CriarGrupoDto(BaseModel):
     nome: str
@@ -149,25 +267,67 @@ class RetornaLabirintosDto(BaseModel):
     labirinto: int
     dificuldade: str
 
+class JobDto(BaseModel):
+    tipo: str
+    parametros: dict = {}
+
+class GeracaoLabirintoDto(BaseModel):
+    vertices: int
+    saidas: int = 1
+    direcional: bool = False
+    com_peso: bool = False
+    seed: Optional[int] = None
+    topologia: str = "arvore"  # One of TOPOLOGIAS
+    dificuldade: Optional[str] = None
+
+class EdicaoVerticesDto(BaseModel):
+    adicionar: List[VerticeModel] = []  # New vertices, or a new tipo for existing ones
+    remover: List[int] = []  # Their edges are removed too
+
+class RemocaoArestaModel(BaseModel):
+    origemId: int
+    destinoId: int
+
+class EdicaoArestasDto(BaseModel):
+    adicionar: List[ArestaModel] = []  # New edges, or a new peso for existing ones
+    remover: List[RemocaoArestaModel] = []
+
+# Response class for payloads that are already plain dicts and lists
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        # orjson encodes UUIDs natively and skips FastAPI's jsonable_encoder pass
+        return orjson.dumps(content)
+
 # Websocket manager
 class ConnectionManager:
     def __init__(self):
         # Dictionary to store session connections
         # Format: {session_id: [list of WebSocket connections]}
         self.session_connections = {}
+        # Format: {labirinto_id: set of session_id}
+        self.labirinto_sessions = {}
 
-    async def connect(self, websocket: WebSocket, session_id: int):
+    async def connect(self, websocket: WebSocket, session_id: int, labirinto_id: Optional[int] = None):
         await websocket.accept()
         if session_id not in self.session_connections:
             self.session_connections[session_id] = []
         self.session_connections[session_id].append(websocket)
+        if labirinto_id is not None:
+            self.labirinto_sessions.setdefault(labirinto_id, set()).add(session_id)
 
-    def disconnect(self, websocket: WebSocket, session_id: int):
+    def disconnect(self, websocket: WebSocket, session_id: int, labirinto_id: Optional[int] = None):
         if session_id in self.session_connections:
             if websocket in self.session_connections[session_id]:
                 self.session_connections[session_id].remove(websocket)
             if not self.session_connections[session_id]:
                 del self.session_connections[session_id]
+        sessoes = self.labirinto_sessions.get(labirinto_id)
+        if sessoes is not None and session_id not in self.session_connections:
+            sessoes.discard(session_id)
+            if not sessoes:
+                del self.labirinto_sessions[labirinto_id]
 
     async def broadcast_to_session(self, message: str, session_id: int):
         if session_id in self.session_connections:
@@ -177,19 +337,1558 @@ class ConnectionManager:
                 except:
                     continue
 
+    async def broadcast_to_labirinto(self, message: str, labirinto_id: int):
+        for session_id in list(self.labirinto_sessions.get(labirinto_id, ())):
+            await self.broadcast_to_session(message, session_id)
+
+# Live move feed for spectators
+class LiveFeed:
+    def __init__(self, max_pendentes: int = 1000, compartilhado: bool = False):
+        # Format: {labirinto_id: set of asyncio.Queue}
+        self.assinantes = {}
+        self.max_pendentes = max_pendentes
+        self.encerrado = False
+        # In a cluster moves are made on other workers too, so the feed is read back from the log
+        self.compartilhado = compartilhado
+        self.ultimo_id = None
+
+    def assinar(self, labirinto_id: int) -> asyncio.Queue:
+        fila = asyncio.Queue(maxsize=self.max_pendentes)
+        if self.encerrado:
+            fila.put_nowait(None)
+        self.assinantes.setdefault(labirinto_id, set()).add(fila)
+        return fila
+
+    def encerrar(self):
+        # None ends every stream; EventSource clients resume later with Last-Event-ID
+        self.encerrado = True
+        for filas in self.assinantes.values():
+            for fila in filas:
+                if fila.full():
+                    fila.get_nowait()
+                fila.put_nowait(None)
+
+    def cancelar(self, labirinto_id: int, fila: asyncio.Queue):
+        filas = self.assinantes.get(labirinto_id)
+        if filas is not None:
+            filas.discard(fila)
+            if not filas:
+                del self.assinantes[labirinto_id]
+
+    def publicar(self, labirinto_id: int, evento: dict):
+        if self.compartilhado:
+            return
+        self._entregar(labirinto_id, evento)
+
+    def _entregar(self, labirinto_id: int, evento: dict):
+        for fila in self.assinantes.get(labirinto_id, ()):
+            try:
+                fila.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Slow spectators lose moves instead of stalling the game loop
+                continue
+
+    def ler_log(self, labirinto_ids: list) -> list:
+        # New rows for the watched mazes; the cursor starts at the tail so only later moves are fed
+        db = SessionLocal()
+        try:
+            if self.ultimo_id is None:
+                self.ultimo_id = db.query(func.max(MovementLog.id)).scalar() or 0
+                return []
+            linhas = db.query(MovementLog, SessaoWebSocket.grupo_id)\
+                .outerjoin(SessaoWebSocket, SessaoWebSocket.id == MovementLog.session_id)\
+                .filter(MovementLog.id > self.ultimo_id, MovementLog.labirinto_id.in_(labirinto_ids))\
+                .order_by(MovementLog.id)\
+                .all()
+            if linhas:
+                self.ultimo_id = linhas[-1][0].id
+            return [(log.labirinto_id, movimento_dto(log, grupo_id)) for log, grupo_id in linhas]
+        finally:
+            db.close()
+
+    async def sincronizar(self, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                eventos = await asyncio.to_thread(self.ler_log, list(self.assinantes))
+            except Exception:
+                traceback.print_exc()
+                continue
+            for labirinto_id, evento in eventos:
+                self._entregar(labirinto_id, evento)
+
+# Leaderboard subscribers, fed with coalesced score diffs
+class PlacarHub:
+    def __init__(self, intervalo: float, compartilhado: bool = False):
+        self.intervalo = intervalo
+        self.assinantes = set()
+        # Format: {(grupo_id, labirinto_id): campos alterados desde o último envio}
+        self.pendentes = {}
+        # In a cluster scores also change on other workers; changed groups are found through the
+        # shared ("placar", grupo_id) cache versions and re-read from info_grupos
+        self.compartilhado = compartilhado
+        # Format: {"placar:<grupo_id>": versao} as of the last sync
+        self.versoes = None
+
+    def assinar(self, websocket: WebSocket):
+        self.assinantes.add(websocket)
+
+    def cancelar(self, websocket: WebSocket):
+        self.assinantes.discard(websocket)
+
+    def publicar(self, grupo_id: UUID, labirinto_id: int, **campos):
+        if not self.assinantes or self.compartilhado:
+            return
+        # Later changes to the same score overwrite earlier ones within an interval
+        diff = self.pendentes.setdefault((grupo_id, labirinto_id), {
+            "grupo_id": str(grupo_id),
+            "labirinto": labirinto_id
+        })
+        diff.update(campos)
+
+    def sincronizar(self) -> dict:
+        # Returns diffs for every score whose group version moved since the last call
+        db = SessionLocal()
+        try:
+            versoes = dict(db.query(VersaoCache.entidade, VersaoCache.versao)
+                           .filter(VersaoCache.entidade.like("placar:%")))
+            anteriores, self.versoes = self.versoes, versoes
+            if anteriores is None:
+                return {}
+            grupos = [UUID(chave.split(":", 1)[1]) for chave, versao in versoes.items()
+                      if anteriores.get(chave) != versao]
+            if not grupos or not self.assinantes:
+                return {}
+            linhas = db.query(
+                InfoGrupo.grupo_id, Grupo.nome, InfoGrupo.labirinto_id,
+                InfoGrupo.passos, InfoGrupo.exploracao, InfoGrupo.concluido
+            ).join(Grupo, Grupo.id == InfoGrupo.grupo_id).filter(InfoGrupo.grupo_id.in_(grupos))
+            return {
+                (grupo_id, labirinto_id): {
+                    "grupo_id": str(grupo_id),
+                    "labirinto": labirinto_id,
+                    "grupo": nome,
+                    "passos": passos,
+                    "exploracao": exploracao,
+                    "concluido": bool(concluido)
+                }
+                for grupo_id, nome, labirinto_id, passos, exploracao, concluido in linhas
+            }
+        finally:
+            db.close()
+
+    async def transmitir(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            if self.compartilhado:
+                try:
+                    self.pendentes.update(await asyncio.to_thread(self.sincronizar))
+                except Exception:
+                    traceback.print_exc()
+            if not self.pendentes:
+                continue
+            mensagem = orjson.dumps({"tipo": "diff", "mudancas": list(self.pendentes.values())}).decode()
+            self.pendentes = {}
+            assinantes = list(self.assinantes)
+            resultados = await asyncio.gather(
+                *(ws.send_text(mensagem) for ws in assinantes), return_exceptions=True
+            )
+            for ws, resultado in zip(assinantes, resultados):
+                if isinstance(resultado, Exception):
+                    self.cancelar(ws)
+
+# Coalesces InfoGrupo progress from ending sessions into batched UPSERTs
+class ProgressoBuffer:
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        # Format: {(grupo_id, labirinto_id): {"passos": soma, "exploracao": máximo, "concluido": any, "consultas_visao": soma}}
+        self.pendentes = {}
+        self.lock = threading.Lock()
+
+    def registrar(self, grupo_id: UUID, labirinto_id: int, passos: int = 0,
+                  exploracao: float = 0.0, concluido: bool = False, consultas_visao: int = 0):
+        # Merged with the same semantics as the UPSERT, so batching never changes the result
+        with self.lock:
+            atual = self.pendentes.get((grupo_id, labirinto_id))
+            if atual is None:
+                self.pendentes[(grupo_id, labirinto_id)] = {
+                    "passos": passos, "exploracao": exploracao, "concluido": concluido,
+                    "consultas_visao": consultas_visao
+                }
+            else:
+                atual["passos"] += passos
+                atual["exploracao"] = max(atual["exploracao"], exploracao)
+                atual["concluido"] = atual["concluido"] or concluido
+                atual["consultas_visao"] += consultas_visao
+
+    def descarregar(self) -> list:
+        # One executemany UPSERT for the whole batch; returns the merged rows
+        with self.lock:
+            pendentes, self.pendentes = self.pendentes, {}
+        if not pendentes:
+            return []
+
+        comando = sqlite_insert(InfoGrupo)
+        novo = comando.excluded
+        comando = comando.on_conflict_do_update(
+            index_elements=[InfoGrupo.grupo_id, InfoGrupo.labirinto_id],
+            set_={
+                "passos": func.coalesce(InfoGrupo.passos, 0) + novo.passos,
+                "exploracao": case(
+                    (novo.exploracao > func.coalesce(InfoGrupo.exploracao, 0), novo.exploracao),
+                    else_=InfoGrupo.exploracao
+                ),
+                "concluido": case((novo.concluido, True), else_=func.coalesce(InfoGrupo.concluido, False)),
+                "consultas_visao": func.coalesce(InfoGrupo.consultas_visao, 0) + novo.consultas_visao
+            }
+        )
+        db = SessionLocal()
+        try:
+            db.execute(comando, [
+                {"grupo_id": grupo_id, "labirinto_id": labirinto_id, **campos}
+                for (grupo_id, labirinto_id), campos in pendentes.items()
+            ])
+            db.commit()
+            return db.query(
+                InfoGrupo.grupo_id, InfoGrupo.labirinto_id,
+                InfoGrupo.passos, InfoGrupo.exploracao, InfoGrupo.concluido
+            ).filter(tuple_(InfoGrupo.grupo_id, InfoGrupo.labirinto_id).in_(list(pendentes))).all()
+        except Exception:
+            db.rollback()
+            # Put the batch back so the next flush retries it
+            for (grupo_id, labirinto_id), campos in pendentes.items():
+                self.registrar(grupo_id, labirinto_id, **campos)
+            raise
+        finally:
+            db.close()
+
+    async def executar(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                atualizados = await asyncio.to_thread(self.descarregar)
+            except Exception:
+                traceback.print_exc()
+                continue
+            response_cache.invalidar(*{("placar", grupo_id) for grupo_id, *_ in atualizados})
+            for grupo_id, labirinto_id, passos, exploracao, concluido in atualizados:
+                placar_hub.publicar(
+                    grupo_id, labirinto_id, passos=passos, exploracao=exploracao, concluido=bool(concluido)
+                )
+
+# Per-vertex and per-edge visit counters, incremented in memory and flushed as additive UPSERTs
+class HeatmapBuffer:
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        # Format: {(labirinto_id, grupo_id, periodo, vertice_id): visitas}
+        self.vertices = {}
+        # Format: {(labirinto_id, grupo_id, periodo, origem_id, destino_id): transicoes}
+        self.arestas = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def periodo_atual() -> str:
+        return datetime.datetime.now().isoformat(timespec="hours")
+
+    def registrar(self, labirinto_id: int, grupo_id: UUID, destino: int, origem: Optional[int] = None):
+        # A move counts one visit to its destination and one transition; origem=None counts the entrance
+        periodo = self.periodo_atual()
+        with self.lock:
+            chave = (labirinto_id, grupo_id, periodo, destino)
+            self.vertices[chave] = self.vertices.get(chave, 0) + 1
+            if origem is not None:
+                chave = (labirinto_id, grupo_id, periodo, origem, destino)
+                self.arestas[chave] = self.arestas.get(chave, 0) + 1
+
+    def descarregar(self) -> set:
+        # Returns the mazes whose counters changed
+        with self.lock:
+            vertices, self.vertices = self.vertices, {}
+            arestas, self.arestas = self.arestas, {}
+        if not vertices and not arestas:
+            return set()
+
+        db = SessionLocal()
+        try:
+            if vertices:
+                comando = sqlite_insert(HeatmapVertice)
+                comando = comando.on_conflict_do_update(
+                    index_elements=[HeatmapVertice.labirinto_id, HeatmapVertice.grupo_id,
+                                    HeatmapVertice.periodo, HeatmapVertice.vertice_id],
+                    set_={"visitas": HeatmapVertice.visitas + comando.excluded.visitas}
+                )
+                db.execute(comando, [
+                    {"labirinto_id": labirinto_id, "grupo_id": grupo_id, "periodo": periodo,
+                     "vertice_id": vertice_id, "visitas": visitas}
+                    for (labirinto_id, grupo_id, periodo, vertice_id), visitas in vertices.items()
+                ])
+            if arestas:
+                comando = sqlite_insert(HeatmapAresta)
+                comando = comando.on_conflict_do_update(
+                    index_elements=[HeatmapAresta.labirinto_id, HeatmapAresta.grupo_id, HeatmapAresta.periodo,
+                                    HeatmapAresta.origem_id, HeatmapAresta.destino_id],
+                    set_={"transicoes": HeatmapAresta.transicoes + comando.excluded.transicoes}
+                )
+                db.execute(comando, [
+                    {"labirinto_id": labirinto_id, "grupo_id": grupo_id, "periodo": periodo,
+                     "origem_id": origem_id, "destino_id": destino_id, "transicoes": transicoes}
+                    for (labirinto_id, grupo_id, periodo, origem_id, destino_id), transicoes in arestas.items()
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put the counts back so the next flush retries them
+            with self.lock:
+                for chave, visitas in vertices.items():
+                    self.vertices[chave] = self.vertices.get(chave, 0) + visitas
+                for chave, transicoes in arestas.items():
+                    self.arestas[chave] = self.arestas.get(chave, 0) + transicoes
+            raise
+        finally:
+            db.close()
+        return {chave[0] for chave in vertices} | {chave[0] for chave in arestas}
+
+    async def executar(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                labirintos = await asyncio.to_thread(self.descarregar)
+            except Exception:
+                traceback.print_exc()
+                continue
+            response_cache.invalidar(*(("heatmap", labirinto_id) for labirinto_id in labirintos))
+
+# Payload seen by the traffic recorder: always hashed, kept verbatim while small enough
+class CargaGravada:
+    def __init__(self, max_corpo: int):
+        self.max_corpo = max_corpo
+        self.tamanho = 0
+        self.hash = hashlib.blake2b(digest_size=16)
+        self.partes = []
+
+    def anexar(self, dados: bytes):
+        self.tamanho += len(dados)
+        self.hash.update(dados)
+        if self.partes is not None:
+            self.partes.append(dados)
+            if self.tamanho > self.max_corpo:
+                self.partes = None
+
+    def dto(self) -> dict:
+        campos = {"tamanho": self.tamanho, "hash": self.hash.hexdigest()}
+        if self.partes is not None:
+            try:
+                campos["texto"] = b"".join(self.partes).decode()
+            except UnicodeDecodeError:
+                pass
+        return campos
+
+# Opt-in JSONL log of HTTP exchanges and websocket frames, replayed by benchmarks/replay_trafego.py
+class GravadorTrafego:
+    def __init__(self, caminho: str, payloads: bool, max_corpo: int):
+        self.caminho = caminho
+        # Without payloads only sizes and hashes are kept
+        self.max_corpo = max_corpo if payloads else -1
+        self.inicio = time.monotonic()
+        self.conexoes = 0
+        self.arquivo = None
+        self.lock = threading.Lock()
+
+    def instante(self) -> float:
+        return round(time.monotonic() - self.inicio, 6)
+
+    def nova_conexao(self) -> int:
+        with self.lock:
+            self.conexoes += 1
+            return self.conexoes
+
+    def carga(self) -> CargaGravada:
+        return CargaGravada(self.max_corpo)
+
+    def registrar(self, evento: dict):
+        linha = orjson.dumps(evento) + b"\n"
+        with self.lock:
+            if self.arquivo is None:
+                # Opened on the first event, so processes that never serve traffic leave no file
+                self.arquivo = open(self.caminho, "ab", buffering=1 << 16)
+                self.arquivo.write(orjson.dumps({
+                    "tipo": "inicio", "t": 0.0, "relogio": datetime.datetime.now().isoformat()
+                }) + b"\n")
+            self.arquivo.write(linha)
+
+    def fechar(self):
+        with self.lock:
+            if self.arquivo is not None:
+                self.arquivo.close()
+                self.arquivo = None
+
+class MiddlewareGravacao:
+    # Plain ASGI, so streamed responses and websocket frames pass through untouched
+    def __init__(self, app, gravador: GravadorTrafego):
+        self.app = app
+        self.gravador = gravador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.gravar_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.gravar_websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def gravar_http(self, scope, receive, send):
+        gravador = self.gravador
+        inicio = gravador.instante()
+        requisicao, resposta = gravador.carga(), gravador.carga()
+        status = None
+
+        async def receber():
+            mensagem = await receive()
+            if mensagem["type"] == "http.request":
+                requisicao.anexar(mensagem.get("body", b""))
+            return mensagem
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            elif mensagem["type"] == "http.response.body":
+                resposta.anexar(mensagem.get("body", b""))
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receber, enviar)
+        finally:
+            cabecalhos = dict(scope.get("headers", ()))
+            gravador.registrar({
+                "tipo": "http",
+                "t": inicio,
+                "c": gravador.nova_conexao(),
+                "duracao": round(gravador.instante() - inicio, 6),
+                "metodo": scope["method"],
+                "caminho": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "conteudo": cabecalhos.get(b"content-type", b"").decode("latin-1"),
+                "status": status,
+                "requisicao": requisicao.dto(),
+                "resposta": resposta.dto()
+            })
+
+    async def gravar_websocket(self, scope, receive, send):
+        gravador = self.gravador
+        conexao = gravador.nova_conexao()
+
+        def frame(tipo: str, mensagem: dict):
+            carga = gravador.carga()
+            texto = mensagem.get("text")
+            carga.anexar(texto.encode() if texto is not None else mensagem.get("bytes") or b"")
+            gravador.registrar({"tipo": tipo, "t": gravador.instante(), "c": conexao, **carga.dto()})
+
+        async def receber():
+            mensagem = await receive()
+            if mensagem["type"] == "websocket.connect":
+                gravador.registrar({
+                    "tipo": "ws_abrir",
+                    "t": gravador.instante(),
+                    "c": conexao,
+                    "caminho": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1")
+                })
+            elif mensagem["type"] == "websocket.receive":
+                frame("ws_cliente", mensagem)
+            elif mensagem["type"] == "websocket.disconnect":
+                gravador.registrar({
+                    "tipo": "ws_fechar", "t": gravador.instante(), "c": conexao,
+                    "codigo": mensagem.get("code", 1000), "origem": "cliente"
+                })
+            return mensagem
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "websocket.send":
+                frame("ws_servidor", mensagem)
+            elif mensagem["type"] == "websocket.close":
+                gravador.registrar({
+                    "tipo": "ws_fechar", "t": gravador.instante(), "c": conexao,
+                    "codigo": mensagem.get("code", 1000), "origem": "servidor"
+                })
+            await send(mensagem)
+
+        await self.app(scope, receber, enviar)
+
+# Graceful shutdown: refuses new sessions, tells clients when to reconnect and waits for their cleanup
+class Desligamento:
+    def __init__(self, prazo: float, espalhamento: float):
+        self.prazo = prazo
+        self.espalhamento = espalhamento
+        self.encerrando = False
+        self.drenagem = None
+
+    def atraso_reconexao(self) -> float:
+        # Jittered so the clients of a restarting worker do not all come back at once
+        return round(random.uniform(1.0, 1.0 + self.espalhamento), 1)
+
+    async def avisar(self, websocket: WebSocket):
+        try:
+            await websocket.send_text(f"Reconectar: {self.atraso_reconexao()}")
+            await websocket.close(code=1012, reason="Servidor reiniciando")
+        except Exception:
+            # Already gone; its handler cleans up on disconnect
+            pass
+
+    async def drenar(self):
+        # Shared by the server hook and the lifespan, whichever runs first
+        if self.drenagem is None:
+            self.encerrando = True
+            self.drenagem = asyncio.ensure_future(self._drenar())
+        await self.drenagem
+
+    async def _drenar(self):
+        limite = time.monotonic() + self.prazo
+        live_feed.encerrar()
+        conexoes = [ws for lista in manager.session_connections.values() for ws in lista]
+        await asyncio.gather(*(self.avisar(ws) for ws in conexoes + list(placar_hub.assinantes)))
+        # Handlers leave the manager and then finish their cleanup without awaiting
+        while manager.session_connections and time.monotonic() < limite:
+            await asyncio.sleep(0.05)
+        # What the handlers buffered goes out in one batch per table
+        try:
+            await asyncio.to_thread(progresso.descarregar)
+            await asyncio.to_thread(heatmap.descarregar)
+        except Exception:
+            traceback.print_exc()
+
+# Timer wheel tracking the last activity of each websocket
+class TimerWheel:
+    def __init__(self, resolucao: float = 1.0, num_slots: int = 512):
+        self.resolucao = resolucao
+        self.num_slots = num_slots
+        self.slots = [set() for _ in range(num_slots)]
+        # Format: {chave: [ultima_atividade, limite, slot]}
+        self.entradas = {}
+        self.tick_atual = int(time.monotonic() / resolucao)
+
+    def _agendar(self, chave, prazo: float):
+        # Deadlines further than one lap wrap around and are re-checked when their slot fires
+        tick = max(int(prazo / self.resolucao), self.tick_atual + 1)
+        slot = tick % self.num_slots
+        self.slots[slot].add(chave)
+        self.entradas[chave][2] = slot
+
+    def registrar(self, chave, limite: float):
+        agora = time.monotonic()
+        self.entradas[chave] = [agora, limite, None]
+        self._agendar(chave, agora + limite)
+
+    def tocar(self, chave):
+        # O(1): only the timestamp moves, the slot is corrected lazily when it fires
+        entrada = self.entradas.get(chave)
+        if entrada is not None:
+            entrada[0] = time.monotonic()
+
+    def remover(self, chave):
+        entrada = self.entradas.pop(chave, None)
+        if entrada is not None:
+            self.slots[entrada[2]].discard(chave)
+
+    def avancar(self, agora: float) -> list:
+        expirados = []
+        tick_final = int(agora / self.resolucao)
+        voltas = min(tick_final - self.tick_atual, self.num_slots)
+        inicio = self.tick_atual
+        for i in range(1, voltas + 1):
+            # Advance as we go so entries that are not due yet land on a later slot
+            self.tick_atual = inicio + i
+            slot = self.slots[self.tick_atual % self.num_slots]
+            chaves = list(slot)
+            slot.clear()
+            for chave in chaves:
+                ultima_atividade, limite, _ = self.entradas[chave]
+                if ultima_atividade + limite <= agora:
+                    del self.entradas[chave]
+                    expirados.append(chave)
+                else:
+                    self._agendar(chave, ultima_atividade + limite)
+        self.tick_atual = tick_final
+        return expirados
+
+# Serialized GET responses keyed by route and params, validated against entity versions
+class ResponseCache:
+    def __init__(self, max_bytes: int, compartilhado: bool = False):
+        self.max_bytes = max_bytes
+        # Format: {chave: (versoes, corpo, etag)}, least recently used first
+        self.entradas = OrderedDict()
+        # Format: {entidade: versao}
+        self.versoes = {}
+        # In a cluster any worker may change the data, so versions live in versoes_cache
+        # and are read once per request instead of from self.versoes
+        self.compartilhado = compartilhado
+        self.tamanho = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def chave_versao(entidade) -> str:
+        # ("placar", grupo_id) -> "placar:<grupo_id>"
+        return ":".join(map(str, entidade)) if isinstance(entidade, tuple) else entidade
+
+    def versao(self, entidade) -> int:
+        return self.versoes.get(entidade, 0)
+
+    def versoes_atuais(self, dependencias: list) -> tuple:
+        if not self.compartilhado:
+            return tuple(self.versao(entidade) for entidade in dependencias)
+        chaves = [self.chave_versao(entidade) for entidade in dependencias]
+        db = SessionLocal()
+        try:
+            versoes = dict(db.query(VersaoCache.entidade, VersaoCache.versao)
+                           .filter(VersaoCache.entidade.in_(chaves)))
+        finally:
+            db.close()
+        return tuple(versoes.get(chave, 0) for chave in chaves)
+
+    def invalidar(self, *entidades):
+        with self.lock:
+            for entidade in entidades:
+                self.versoes[entidade] = self.versoes.get(entidade, 0) + 1
+        if self.compartilhado and entidades:
+            comando = sqlite_insert(VersaoCache)
+            comando = comando.on_conflict_do_update(
+                index_elements=[VersaoCache.entidade],
+                set_={"versao": VersaoCache.versao + 1}
+            )
+            db = SessionLocal()
+            try:
+                db.execute(comando, [{"entidade": self.chave_versao(entidade), "versao": 1} for entidade in entidades])
+                db.commit()
+            finally:
+                db.close()
+
+    def obter(self, chave, versoes: tuple):
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada is None or entrada[0] != versoes:
+                self.misses += 1
+                return None
+            self.entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada
+
+    def guardar(self, chave, versoes: tuple, corpo: bytes):
+        etag = '"' + hashlib.blake2b(corpo, digest_size=12).hexdigest() + '"'
+        entrada = (versoes, corpo, etag)
+        if len(corpo) > self.max_bytes:
+            return entrada
+        with self.lock:
+            anterior = self.entradas.pop(chave, None)
+            if anterior is not None:
+                self.tamanho -= len(anterior[1])
+            self.entradas[chave] = entrada
+            self.tamanho += len(corpo)
+            while self.tamanho > self.max_bytes:
+                _, removida = self.entradas.popitem(last=False)
+                self.tamanho -= len(removida[1])
+                self.evictions += 1
+        return entrada
+
+    def estatisticas(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entradas": len(self.entradas),
+            "bytes": self.tamanho,
+            "max_bytes": self.max_bytes
+        }
+
+MetaGrupo = namedtuple("MetaGrupo", ["id", "nome"])
+MetaLabirinto = namedtuple("MetaLabirinto", ["id", "entrada", "saidas", "dificuldade"])
+
+# Bounded LRU of group and maze metadata, so existence checks skip the database
+class EntidadeCache:
+    def __init__(self, max_entradas: int, compartilhado: bool = False):
+        self.max_entradas = max_entradas
+        # Groups never change once created, but in a cluster a maze may be edited on
+        # another worker, so mazes are always read from the database there
+        self.compartilhado = compartilhado
+        # Format: {("grupo", id) | ("labirinto", id): MetaGrupo | MetaLabirinto}
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _obter(self, chave, carregar):
+        with self.lock:
+            meta = self.entradas.get(chave)
+            if meta is not None:
+                self.entradas.move_to_end(chave)
+                return meta
+        # Misses are not cached: an unknown id may be created right after
+        meta = carregar()
+        if meta is not None:
+            with self.lock:
+                self.entradas[chave] = meta
+                while len(self.entradas) > self.max_entradas:
+                    self.entradas.popitem(last=False)
+        return meta
+
+    def grupo(self, grupo_id: UUID) -> Optional[MetaGrupo]:
+        def carregar():
+            db = SessionLocal()
+            try:
+                linha = db.query(Grupo.id, Grupo.nome).filter(Grupo.id == grupo_id).first()
+                return MetaGrupo(*linha) if linha else None
+            finally:
+                db.close()
+        return self._obter(("grupo", grupo_id), carregar)
+
+    def labirinto(self, labirinto_id: int) -> Optional[MetaLabirinto]:
+        def carregar():
+            db = SessionLocal()
+            try:
+                linha = db.query(Labirinto.id, Labirinto.entrada, Labirinto.saida, Labirinto.dificuldade)\
+                    .filter(Labirinto.id == labirinto_id)\
+                    .first()
+                if not linha:
+                    return None
+                saidas = frozenset(int(s) for s in (linha.saida or "").split(",") if s.strip())
+                return MetaLabirinto(linha.id, linha.entrada, saidas, linha.dificuldade)
+            finally:
+                db.close()
+        if self.compartilhado:
+            return carregar()
+        return self._obter(("labirinto", labirinto_id), carregar)
+
+    def descartar(self, tipo: str, entidade_id):
+        with self.lock:
+            self.entradas.pop((tipo, entidade_id), None)
+
+# In-memory graph of a maze, used by the websocket hot path
+class GrafoLabirinto:
+    def __init__(self, labirinto_id: int, entrada: int, tipos: dict, adjacencia: dict):
+        self.labirinto_id = labirinto_id
+        self.entrada = entrada
+        # Format: {vertice_id: tipo}
+        self.tipos = tipos
+        # Format: {vertice_id: [(destino_id, peso)]}
+        self.adjacencia = adjacencia
+        self.saidas = frozenset(v for v, tipo in tipos.items() if tipo == 2)
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.tipos)
+
+    def contem(self, vertice_id: int) -> bool:
+        return vertice_id in self.tipos
+
+    def tipo(self, vertice_id: int) -> int:
+        return self.tipos.get(vertice_id)
+
+    def adjacentes(self, vertice_id: int) -> list:
+        return self.adjacencia.get(vertice_id, [])
+
+def carregar_grafo(db, labirinto_id: int) -> Optional[GrafoLabirinto]:
+    labirinto = db.query(Labirinto.entrada).filter(Labirinto.id == labirinto_id).first()
+    if not labirinto:
+        return None
+
+    tipos = dict(db.query(Vertice.id, Vertice.tipo).filter(Vertice.labirinto_id == labirinto_id))
+    adjacencia = {}
+    arestas = db.query(Aresta.vertice_origem_id, Aresta.vertice_destino_id, Aresta.peso)\
+        .filter(Aresta.labirinto_id == labirinto_id)
+    for origem, destino, peso in arestas:
+        adjacencia.setdefault(origem, []).append((destino, peso))
+    return GrafoLabirinto(labirinto_id, labirinto.entrada, tipos, adjacencia)
+
+# Binary CSR snapshot of a maze, opened read-only with mmap so every worker shares the pages
+SNAPSHOT_MAGIC = b"LABS"
+SNAPSHOT_VERSAO = 1
+# magic, versao, labirinto_id, entrada, num_vertices, num_arestas, num_saidas, bytes da dificuldade
+SNAPSHOT_HEADER = struct.Struct("<4sIiiiiii")
+
+class SnapshotLabirinto:
+    def __init__(self, caminho: str):
+        with open(caminho, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Snapshots are replaced atomically, so a new inode means a newer version
+            self.inode = os.fstat(f.fileno()).st_ino
+        (magic, versao, self.labirinto_id, self.entrada, n, m, k, tamanho_dificuldade) = \
+            SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or versao != SNAPSHOT_VERSAO:
+            raise ValueError(f"Snapshot inválido: {caminho}")
+
+        dados = memoryview(self._mmap)
+        posicao = SNAPSHOT_HEADER.size
+
+        def secao(quantidade):
+            nonlocal posicao
+            inicio, posicao = posicao, posicao + 4 * quantidade
+            if sys.byteorder == "little":
+                return dados[inicio:posicao].cast("i")
+            # Big-endian hosts pay for a private copy instead of sharing the mapping
+            valores = array("i", dados[inicio:posicao])
+            valores.byteswap()
+            return valores
+
+        # Vertex ids are sorted; position i holds tipo, and edges offsets[i]:offsets[i + 1]
+        self.vertices = secao(n)
+        self.tipos = secao(n)
+        self.offsets = secao(n + 1)
+        self.destinos = secao(m)
+        self.pesos = secao(m)
+        self.saidas = frozenset(secao(k))
+        self.dificuldade = bytes(dados[posicao:posicao + tamanho_dificuldade]).decode("utf-8")
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def num_arestas(self) -> int:
+        return len(self.destinos)
+
+    def _indice(self, vertice_id: int) -> int:
+        i = bisect_left(self.vertices, vertice_id)
+        return i if i < len(self.vertices) and self.vertices[i] == vertice_id else -1
+
+    def contem(self, vertice_id: int) -> bool:
+        return self._indice(vertice_id) >= 0
+
+    def tipo(self, vertice_id: int) -> Optional[int]:
+        i = self._indice(vertice_id)
+        return self.tipos[i] if i >= 0 else None
+
+    def adjacentes(self, vertice_id: int) -> list:
+        i = self._indice(vertice_id)
+        if i < 0:
+            return []
+        inicio, fim = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.destinos[inicio:fim], self.pesos[inicio:fim]))
+
+def escrever_snapshot(caminho: str, labirinto_id: int, entrada: int, dificuldade: str,
+                      tipos: dict, adjacencia: dict):
+    vertices = array("i", sorted(tipos))
+    offsets = array("i", [0])
+    destinos = array("i")
+    pesos = array("i")
+    for vertice_id in vertices:
+        for destino, peso in adjacencia.get(vertice_id, ()):
+            destinos.append(destino)
+            pesos.append(peso)
+        offsets.append(len(destinos))
+    gravar_csr(caminho, labirinto_id, entrada, dificuldade,
+               vertices, array("i", (tipos[v] for v in vertices)), offsets, destinos, pesos)
+
+def gravar_csr(caminho: str, labirinto_id: int, entrada: int, dificuldade: str,
+               vertices: array, tipos: array, offsets: array, destinos: array, pesos: array):
+    saidas = array("i", (v for v, tipo in zip(vertices, tipos) if tipo == 2))
+    dificuldade_bytes = (dificuldade or "").encode("utf-8")
+
+    secoes = [vertices, tipos, offsets, destinos, pesos, saidas]
+    if sys.byteorder != "little":
+        for secao in secoes:
+            secao.byteswap()
+
+    # Write next to the target and rename, so readers never map a half-written file
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSAO, labirinto_id, entrada,
+            len(vertices), len(destinos), len(saidas), len(dificuldade_bytes)
+        ))
+        for secao in secoes:
+            f.write(secao.tobytes())
+        f.write(dificuldade_bytes)
+    os.replace(temporario, caminho)
+
+def editar_snapshot(grafo: SnapshotLabirinto, caminho: str, tipos: dict, removidos: set,
+                    arestas_removidas: set, arestas: dict):
+    # Applies an edit to the mapped CSR arrays and writes the result, without touching the database.
+    # tipos: {vertice_id: tipo} added or retyped; removidos: vertex ids, dropped with every edge
+    # touching them; arestas_removidas: {(origem, destino)}; arestas: {(origem, destino): peso}
+    novas = {}
+    for (origem, destino), peso in arestas.items():
+        novas.setdefault(origem, {})[destino] = peso
+    retiradas = {}
+    for origem, destino in arestas_removidas:
+        retiradas.setdefault(origem, set()).add(destino)
+
+    antigos, offsets_antigos = grafo.vertices, grafo.offsets
+    n = len(antigos)
+    tocados = set(tipos) | removidos | set(novas) | set(retiradas)
+    if removidos:
+        # Edges pointing at a removed vertex also change their origin's list
+        for j, destino in enumerate(grafo.destinos):
+            if destino in removidos:
+                tocados.add(antigos[bisect_right(offsets_antigos, j) - 1])
+
+    vertices, novos_tipos, offsets, destinos, pesos = array("i"), array("i"), array("i", [0]), array("i"), array("i")
+    copiados = 0
+
+    def copiar(ate: int):
+        # Untouched vertices between edits are copied in bulk, shifting only their offsets
+        nonlocal copiados
+        if ate > copiados:
+            inicio, fim = offsets_antigos[copiados], offsets_antigos[ate]
+            deslocamento = len(destinos) - inicio
+            vertices.frombytes(memoryview(antigos[copiados:ate]).cast("B"))
+            novos_tipos.frombytes(memoryview(grafo.tipos[copiados:ate]).cast("B"))
+            offsets.extend([offset + deslocamento for offset in offsets_antigos[copiados + 1:ate + 1]])
+            destinos.frombytes(memoryview(grafo.destinos[inicio:fim]).cast("B"))
+            pesos.frombytes(memoryview(grafo.pesos[inicio:fim]).cast("B"))
+        copiados = max(copiados, ate)
+
+    for vertice_id in sorted(tocados):
+        i = bisect_left(antigos, vertice_id)
+        copiar(i)
+        existe = i < n and antigos[i] == vertice_id
+        if existe:
+            copiados = i + 1
+        if vertice_id in removidos or not (existe or vertice_id in tipos):
+            continue
+        if existe:
+            inicio, fim = offsets_antigos[i], offsets_antigos[i + 1]
+            adjacentes = dict(zip(grafo.destinos[inicio:fim], grafo.pesos[inicio:fim]))
+            novos_tipos.append(tipos.get(vertice_id, grafo.tipos[i]))
+        else:
+            adjacentes = {}
+            novos_tipos.append(tipos[vertice_id])
+        for destino in retiradas.get(vertice_id, ()):
+            adjacentes.pop(destino, None)
+        adjacentes.update(novas.get(vertice_id, {}))
+        vertices.append(vertice_id)
+        for destino, peso in adjacentes.items():
+            if destino not in removidos:
+                destinos.append(destino)
+                pesos.append(peso)
+        offsets.append(len(destinos))
+    copiar(n)
+
+    gravar_csr(caminho, grafo.labirinto_id, grafo.entrada, grafo.dificuldade,
+               vertices, novos_tipos, offsets, destinos, pesos)
+
+def reexportar_snapshot(labirinto_id: int) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        return exportar_snapshot(db, labirinto_id)
+    finally:
+        db.close()
+
+def caminho_snapshot(labirinto_id: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"labirinto_{labirinto_id}.bin")
+
+def exportar_snapshot(db, labirinto_id: int, caminho: Optional[str] = None) -> Optional[str]:
+    labirinto = db.query(Labirinto.dificuldade).filter(Labirinto.id == labirinto_id).first()
+    grafo = carregar_grafo(db, labirinto_id)
+    if grafo is None:
+        return None
+    caminho = caminho or caminho_snapshot(labirinto_id)
+    escrever_snapshot(caminho, labirinto_id, grafo.entrada, labirinto.dificuldade, grafo.tipos, grafo.adjacencia)
+    return caminho
+
+def inserir_labirinto(db, dificuldade: str, entrada: int, vertices: list, arestas: list) -> int:
+    # vertices: [(id, tipo)], arestas: [(origem, destino, peso)]; inserted with executemany
+    labirinto_db = Labirinto(
+        entrada=entrada,
+        dificuldade=dificuldade,
+        saida="".join(f"{vertice_id}, " for vertice_id, tipo in vertices if tipo == 2) or None
+    )
+    db.add(labirinto_db)
+    db.flush()
+    if vertices:
+        db.execute(insert(Vertice), [
+            {"id": vertice_id, "labirinto_id": labirinto_db.id, "tipo": tipo}
+            for vertice_id, tipo in vertices
+        ])
+    if arestas:
+        db.execute(insert(Aresta), [
+            {"vertice_origem_id": origem, "vertice_destino_id": destino,
+             "peso": peso, "labirinto_id": labirinto_db.id}
+            for origem, destino, peso in arestas
+        ])
+    db.commit()
+    return labirinto_db.id
+
+def indexar_grafo(grafo: SnapshotLabirinto):
+    # Edge targets as vertex positions (-1 for edges pointing outside the maze)
+    posicao = {vertice_id: i for i, vertice_id in enumerate(grafo.vertices)}
+    alvos = array("i", [posicao.get(destino, -1) for destino in grafo.destinos])
+    return posicao, alvos
+
+def bfs_niveis(offsets, alvos, n: int, origem: int) -> array:
+    distancias = array("i", [-1]) * n
+    distancias[origem] = 0
+    fronteira = [origem]
+    nivel = 0
+    while fronteira:
+        nivel += 1
+        proxima = []
+        for u in fronteira:
+            for v in alvos[offsets[u]:offsets[u + 1]]:
+                if v >= 0 and distancias[v] < 0:
+                    distancias[v] = nivel
+                    proxima.append(v)
+        fronteira = proxima
+    return distancias
+
+def dijkstra(offsets, alvos, pesos, n: int, origem: int, anteriores: Optional[list] = None) -> list:
+    # When given, anteriores[v] receives the predecessor of v on its shortest path
+    custos = [None] * n
+    custos[origem] = 0
+    heap = [(0, origem)]
+    while heap:
+        custo, u = heapq.heappop(heap)
+        if custo > custos[u]:
+            continue
+        for j in range(offsets[u], offsets[u + 1]):
+            v = alvos[j]
+            if v < 0:
+                continue
+            novo = custo + pesos[j]
+            if custos[v] is None or novo < custos[v]:
+                custos[v] = novo
+                if anteriores is not None:
+                    anteriores[v] = u
+                heapq.heappush(heap, (novo, v))
+    return custos
+
+def componentes_fortes(offsets, alvos, n: int) -> array:
+    # Iterative Tarjan; returns the component number of each vertex position
+    indice = array("i", [-1]) * n
+    menor = array("i", [0]) * n
+    componente = array("i", [-1]) * n
+    na_pilha = bytearray(n)
+    pilha = []
+    contador = 0
+    num_componentes = 0
+    for raiz in range(n):
+        if indice[raiz] >= 0:
+            continue
+        chamadas = [(raiz, offsets[raiz])]
+        indice[raiz] = menor[raiz] = contador
+        contador += 1
+        pilha.append(raiz)
+        na_pilha[raiz] = 1
+        while chamadas:
+            u, j = chamadas[-1]
+            if j < offsets[u + 1]:
+                chamadas[-1] = (u, j + 1)
+                v = alvos[j]
+                if v < 0:
+                    continue
+                if indice[v] < 0:
+                    indice[v] = menor[v] = contador
+                    contador += 1
+                    pilha.append(v)
+                    na_pilha[v] = 1
+                    chamadas.append((v, offsets[v]))
+                elif na_pilha[v] and indice[v] < menor[u]:
+                    menor[u] = indice[v]
+                continue
+            chamadas.pop()
+            if chamadas:
+                pai = chamadas[-1][0]
+                if menor[u] < menor[pai]:
+                    menor[pai] = menor[u]
+            if menor[u] == indice[u]:
+                while True:
+                    v = pilha.pop()
+                    na_pilha[v] = 0
+                    componente[v] = num_componentes
+                    if v == u:
+                        break
+                num_componentes += 1
+    return componente
+
+def analisar_grafo(grafo: SnapshotLabirinto) -> dict:
+    n = grafo.num_vertices
+    # Plain lists index faster than memoryviews in the tight loops below
+    offsets = list(grafo.offsets)
+    posicao, alvos = indexar_grafo(grafo)
+    alvos = list(alvos)
+
+    grau_saida = [offsets[i + 1] - offsets[i] for i in range(n)]
+    grau_entrada = [0] * n
+    # Distinct neighbour per vertex, ignoring direction: -1 none yet, -2 more than one
+    vizinho = array("i", [-1]) * n
+    for u in range(n):
+        for v in alvos[offsets[u]:offsets[u + 1]]:
+            if v < 0 or v == u:
+                continue
+            grau_entrada[v] += 1
+            if vizinho[u] == -1:
+                vizinho[u] = v
+            elif vizinho[u] != v:
+                vizinho[u] = -2
+            if vizinho[v] == -1:
+                vizinho[v] = u
+            elif vizinho[v] != u:
+                vizinho[v] = -2
+
+    entrada = posicao.get(grafo.entrada)
+    saidas = sorted(posicao[s] for s in grafo.saidas if s in posicao)
+    especiais = set(saidas)
+    if entrada is not None:
+        especiais.add(entrada)
+    becos = sum(1 for i in range(n) if vizinho[i] >= 0 and i not in especiais)
+
+    componente = componentes_fortes(offsets, alvos, n)
+    tamanhos = {}
+    for c in componente:
+        tamanhos[c] = tamanhos.get(c, 0) + 1
+
+    resultado = {
+        "labirinto": grafo.labirinto_id,
+        "vertices": n,
+        "arestas": grafo.num_arestas,
+        "distribuicao_grau_saida": distribuicao(grau_saida),
+        "distribuicao_grau_entrada": distribuicao(grau_entrada),
+        "componentes_fortemente_conexas": {
+            "quantidade": len(tamanhos),
+            "maior": max(tamanhos.values(), default=0),
+            "entrada": tamanhos[componente[entrada]] if entrada is not None else 0
+        },
+        "becos_sem_saida": becos,
+        "excentricidade_entrada": None,
+        "alcancaveis": 0,
+        "caminhos_saidas": [],
+        "fator_ramificacao": 0.0
+    }
+    if entrada is None:
+        return resultado
+
+    niveis = bfs_niveis(offsets, alvos, n, entrada)
+    custos = dijkstra(offsets, alvos, list(grafo.pesos), n, entrada)
+    alcancaveis = [i for i in range(n) if niveis[i] >= 0]
+    ramificaveis = [grau_saida[i] for i in alcancaveis if i not in especiais or i == entrada]
+
+    resultado["excentricidade_entrada"] = max(niveis[i] for i in alcancaveis)
+    resultado["alcancaveis"] = len(alcancaveis)
+    resultado["caminhos_saidas"] = [
+        {
+            "saida": grafo.vertices[i],
+            "passos": niveis[i] if niveis[i] >= 0 else None,
+            "custo": custos[i]
+        }
+        for i in saidas
+    ]
+    resultado["fator_ramificacao"] = sum(ramificaveis) / len(ramificaveis) if ramificaveis else 0.0
+    return resultado
+
+def distribuicao(graus: list) -> dict:
+    contagem = {}
+    for grau in graus:
+        contagem[grau] = contagem.get(grau, 0) + 1
+    return {str(grau): contagem[grau] for grau in sorted(contagem)}
+
+def vizinhanca(grafo, origem: int, raio: int, limite: int, visitados: set) -> dict:
+    # BFS up to `raio` hops; vertices are [id, tipo, distancia, visitado], edges [origem, destino, peso]
+    distancias = {origem: 0}
+    fronteira = [origem]
+    truncado = False
+    for distancia in range(1, raio + 1):
+        proxima = []
+        for u in fronteira:
+            for v, _ in grafo.adjacentes(u):
+                if v in distancias or not grafo.contem(v):
+                    continue
+                if len(distancias) >= limite:
+                    truncado = True
+                    break
+                distancias[v] = distancia
+                proxima.append(v)
+            if truncado:
+                break
+        fronteira = proxima
+        if truncado or not fronteira:
+            break
+    return {
+        "origem": origem,
+        "raio": raio,
+        "vertices": [[v, grafo.tipo(v), d, int(v in visitados)] for v, d in distancias.items()],
+        # Outgoing edges of the vertices inside the radius, when both ends were returned
+        "arestas": [
+            [u, v, peso]
+            for u, d in distancias.items() if d < raio
+            for v, peso in grafo.adjacentes(u) if v in distancias
+        ],
+        "truncado": truncado
+    }
+
+class GrafoCache:
+    def __init__(self, revalidar_sempre: bool = False):
+        # Format: {labirinto_id: GrafoLabirinto}
+        self.grafos = {}
+        # Cluster workers check the snapshot on every lookup, since edits may come from another worker
+        self.revalidar_sempre = revalidar_sempre
+        self.lock = threading.Lock()
+        # Warm-up progress reported by /ready
+        self.aquecimento_total = 0
+        self.aquecimento_carregados = 0
+        # Format: {labirinto_id | "lista": mensagem} for the warm-up loads that failed
+        self.aquecimento_erros = {}
+        self.pronto = False
+
+    def obter(self, labirinto_id: int, revalidar: bool = False):
+        grafo = self.grafos.get(labirinto_id)
+        if grafo is not None:
+            if not revalidar and not self.revalidar_sempre:
+                return grafo
+            # Picks up edits published by another worker; a single stat
+            try:
+                if os.stat(caminho_snapshot(labirinto_id)).st_ino == getattr(grafo, "inode", None):
+                    return grafo
+            except FileNotFoundError:
+                pass
+            self.descartar(labirinto_id)
+
+        # Prefer the shared snapshot; the first worker to miss it exports one from the database
+        caminho = caminho_snapshot(labirinto_id)
+        if not os.path.exists(caminho):
+            db = SessionLocal()
+            try:
+                caminho = exportar_snapshot(db, labirinto_id)
+            finally:
+                db.close()
+        if caminho is not None:
+            grafo = SnapshotLabirinto(caminho)
+            with self.lock:
+                grafo = self.grafos.setdefault(labirinto_id, grafo)
+        return grafo
+
+    def descartar(self, labirinto_id: int):
+        with self.lock:
+            self.grafos.pop(labirinto_id, None)
+
+    def aquecer(self, labirinto_ids: list, workers: int):
+        # A maze that fails to load is logged and retried on demand; it never keeps the worker unready
+        self.aquecimento_total = len(labirinto_ids)
+        self.aquecimento_carregados = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for carregado in executor.map(self._aquecer, labirinto_ids):
+                    self.aquecimento_carregados += carregado
+        finally:
+            self.pronto = True
+
+    def _aquecer(self, labirinto_id: int) -> bool:
+        try:
+            self.obter(labirinto_id)
+            return True
+        except Exception as erro:
+            traceback.print_exc()
+            self.aquecimento_erros[labirinto_id] = f"{type(erro).__name__}: {erro}"
+            return False
+
+# Token bucket used to rate limit moves
+class TokenBucket:
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+
+    def consumir(self, quantidade: float = 1.0) -> float:
+        # Returns 0 when allowed, otherwise the seconds until enough tokens refill
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if self.tokens >= quantidade:
+            self.tokens -= quantidade
+            return 0.0
+        return (quantidade - self.tokens) / self.taxa
+
+    def devolver(self, quantidade: float = 1.0):
+        self.tokens = min(self.capacidade, self.tokens + quantidade)
+
+# Admission control for websocket connections and moves
+class AdmissionControl:
+    def __init__(self, max_conexoes: int, max_fila: int, espera_fila: float,
+                 max_sessoes_grupo: int, max_sessoes_labirinto: int,
+                 taxa_sessao: float, rajada_sessao: float, taxa_grupo: float, rajada_grupo: float):
+        self.vagas = asyncio.Semaphore(max_conexoes)
+        self.max_fila = max_fila
+        self.espera_fila = espera_fila
+        self.aguardando = 0
+        self.max_sessoes_grupo = max_sessoes_grupo
+        self.max_sessoes_labirinto = max_sessoes_labirinto
+        # Format: {grupo_id: quantidade} and {labirinto_id: quantidade}
+        self.sessoes_grupo = {}
+        self.sessoes_labirinto = {}
+        self.taxa_sessao, self.rajada_sessao = taxa_sessao, rajada_sessao
+        self.taxa_grupo, self.rajada_grupo = taxa_grupo, rajada_grupo
+        # Format: {session_id: TokenBucket} and {grupo_id: TokenBucket}
+        self.buckets_sessao = {}
+        self.buckets_grupo = {}
+
+    async def admitir_conexao(self) -> Optional[str]:
+        if self.vagas.locked() and self.aguardando >= self.max_fila:
+            return "Servidor lotado, tente novamente mais tarde."
+        self.aguardando += 1
+        try:
+            await asyncio.wait_for(self.vagas.acquire(), timeout=self.espera_fila)
+            return None
+        except asyncio.TimeoutError:
+            return "Tempo de espera por uma vaga esgotado, tente novamente mais tarde."
+        finally:
+            self.aguardando -= 1
+
+    def liberar_conexao(self):
+        self.vagas.release()
+
+    def reservar_sessao(self, grupo_id: UUID, labirinto_id: int) -> Optional[str]:
+        if self.sessoes_grupo.get(grupo_id, 0) >= self.max_sessoes_grupo:
+            return "Limite de sessões simultâneas do grupo atingido."
+        if self.sessoes_labirinto.get(labirinto_id, 0) >= self.max_sessoes_labirinto:
+            return "Limite de sessões simultâneas do labirinto atingido."
+        self.sessoes_grupo[grupo_id] = self.sessoes_grupo.get(grupo_id, 0) + 1
+        self.sessoes_labirinto[labirinto_id] = self.sessoes_labirinto.get(labirinto_id, 0) + 1
+        return None
+
+    def liberar_sessao(self, grupo_id: UUID, labirinto_id: int, session_id: Optional[int]):
+        for contagem, chave in ((self.sessoes_grupo, grupo_id), (self.sessoes_labirinto, labirinto_id)):
+            contagem[chave] -= 1
+            if not contagem[chave]:
+                del contagem[chave]
+        self.buckets_sessao.pop(session_id, None)
+        if grupo_id not in self.sessoes_grupo:
+            self.buckets_grupo.pop(grupo_id, None)
+
+    def consumir_movimento(self, session_id: int, grupo_id: UUID) -> float:
+        sessao = self.buckets_sessao.get(session_id)
+        if sessao is None:
+            sessao = self.buckets_sessao[session_id] = TokenBucket(self.taxa_sessao, self.rajada_sessao)
+        grupo = self.buckets_grupo.get(grupo_id)
+        if grupo is None:
+            grupo = self.buckets_grupo[grupo_id] = TokenBucket(self.taxa_grupo, self.rajada_grupo)
+
+        espera = sessao.consumir()
+        if espera:
+            return espera
+        espera = grupo.consumir()
+        if espera:
+            # The move is refused, so the session keeps its token
+            sessao.devolver()
+        return espera
+
+# Runs heavy jobs in a process pool; job state lives in the jobs table
+class JobExecutor:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool = None
+        self.tarefas = set()
+
+    def iniciar(self, retomar: bool = True):
+        # spawn: children must not inherit the server's threads or open connections
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        if not retomar:
+            return
+        db = SessionLocal()
+        try:
+            # Jobs interrupted by a restart are queued again
+            pendentes = db.query(Job.id)\
+                .filter(Job.estado.in_(("pendente", "executando")))\
+                .order_by(Job.criado_em)\
+                .all()
+        finally:
+            db.close()
+        for job_id, in pendentes:
+            self.agendar(job_id)
+
+    def encerrar(self):
+        for tarefa in self.tarefas:
+            tarefa.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def submeter(self, tipo: str, parametros: dict) -> str:
+        agora = datetime.datetime.now().isoformat()
+        job = Job(
+            id=uuid.uuid4().hex,
+            tipo=tipo,
+            parametros=json.dumps(parametros),
+            estado="pendente",
+            progresso=0.0,
+            criado_em=agora,
+            atualizado_em=agora
+        )
+        db = SessionLocal()
+        try:
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+        self.agendar(job_id)
+        return job_id
+
+    def agendar(self, job_id: str):
+        tarefa = asyncio.get_running_loop().create_task(self._executar(job_id))
+        self.tarefas.add(tarefa)
+        tarefa.add_done_callback(self.tarefas.discard)
+
+    async def _executar(self, job_id: str):
+        loop = asyncio.get_running_loop()
+        try:
+            tipo, resultado = await loop.run_in_executor(self.pool, executar_job, job_id)
+        except Exception as e:
+            # The worker itself died (e.g. out of memory); the job code never got to record it
+            atualizar_job(job_id, estado="falhou", erro=repr(e))
+            return
+        if tipo in ("ingestao", "geracao") and resultado:
+            response_cache.invalidar("labirintos")
+
+# Consistent-hash ring assigning mazes (or sessions) to the worker processes of a cluster
+class Roteador:
+    def __init__(self, workers: list, worker_id: int, chave: str = "labirinto", replicas: int = 64):
+        self.workers = workers
+        self.worker_id = worker_id
+        self.chave = chave
+        # Format: [(ponto, indice_worker)] sorted by ponto; replicas smooth out the split
+        self.anel = sorted(
+            (self._hash(f"{url}#{replica}"), indice)
+            for indice, url in enumerate(workers)
+            for replica in range(replicas)
+        )
+        self.pontos = [ponto for ponto, _ in self.anel]
+
+    @staticmethod
+    def _hash(chave: str) -> int:
+        return int.from_bytes(hashlib.blake2b(chave.encode(), digest_size=8).digest(), "big")
+
+    @property
+    def ativo(self) -> bool:
+        return len(self.workers) > 1
+
+    def dono(self, labirinto_id: int, session_id: Optional[int] = None) -> int:
+        if not self.ativo:
+            return self.worker_id
+        if self.chave == "sessao":
+            if session_id is None:
+                # The session is created wherever the client lands
+                return self.worker_id
+            chave = f"sessao:{session_id}"
+        else:
+            chave = f"labirinto:{labirinto_id}"
+        i = bisect_left(self.pontos, self._hash(chave)) % len(self.anel)
+        return self.anel[i][1]
+
+    def local(self, labirinto_id: int, session_id: Optional[int] = None) -> bool:
+        return self.dono(labirinto_id, session_id) == self.worker_id
+
+    def url(self, indice: int) -> str:
+        return self.workers[indice] if self.workers else "ws://localhost:8000"
+
+# Configuration
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./db.sqlite3")
+DB_ECHO = os.environ.get("DB_ECHO", "0") == "1"
+MIGRAR_NA_INICIALIZACAO = os.environ.get("MIGRAR_NA_INICIALIZACAO", "1") == "1"
+WARMUP_LABIRINTOS = os.environ.get("WARMUP_LABIRINTOS", "todos")  # "todos", "0" or the N most played
+WARMUP_WORKERS = int(os.environ.get("WARMUP_WORKERS", "4"))
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "./snapshots")
+IDLE_TIMEOUT_JOGADOR = float(os.environ.get("IDLE_TIMEOUT_JOGADOR", "60"))
+IDLE_TIMEOUT_OBSERVADOR = float(os.environ.get("IDLE_TIMEOUT_OBSERVADOR", "300"))
+REAPER_INTERVALO = float(os.environ.get("REAPER_INTERVALO", "1"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+MAX_CONEXOES = int(os.environ.get("MAX_CONEXOES", "1000"))
+MAX_FILA_CONEXOES = int(os.environ.get("MAX_FILA_CONEXOES", "100"))
+ESPERA_FILA_CONEXOES = float(os.environ.get("ESPERA_FILA_CONEXOES", "10"))
+MAX_SESSOES_GRUPO = int(os.environ.get("MAX_SESSOES_GRUPO", "5"))
+MAX_SESSOES_LABIRINTO = int(os.environ.get("MAX_SESSOES_LABIRINTO", "200"))
+MOVIMENTOS_POR_SEGUNDO = float(os.environ.get("MOVIMENTOS_POR_SEGUNDO", "10"))
+RAJADA_MOVIMENTOS = float(os.environ.get("RAJADA_MOVIMENTOS", "20"))
+MOVIMENTOS_POR_SEGUNDO_GRUPO = float(os.environ.get("MOVIMENTOS_POR_SEGUNDO_GRUPO", "30"))
+RAJADA_MOVIMENTOS_GRUPO = float(os.environ.get("RAJADA_MOVIMENTOS_GRUPO", "60"))
+PLACAR_INTERVALO = float(os.environ.get("PLACAR_INTERVALO", "1"))
+AO_VIVO_INTERVALO_CLUSTER = float(os.environ.get("AO_VIVO_INTERVALO_CLUSTER", "0.25"))  # Log polling for /ao-vivo in a cluster
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ENTIDADES_MAX = int(os.environ.get("ENTIDADES_MAX", "10000"))
+PROGRESSO_INTERVALO = float(os.environ.get("PROGRESSO_INTERVALO", "0.5"))
+HEATMAP_INTERVALO = float(os.environ.get("HEATMAP_INTERVALO", "2"))
+HEATMAP_TOP_MAX = int(os.environ.get("HEATMAP_TOP_MAX", "100"))
+RAIO_VISAO_MAX = int(os.environ.get("RAIO_VISAO_MAX", "2"))  # 0 disables the "ver:<k>" command
+VISAO_MAX_VERTICES = int(os.environ.get("VISAO_MAX_VERTICES", "256"))
+VISAO_CONTA_EXPLORACAO = os.environ.get("VISAO_CONTA_EXPLORACAO", "0") == "1"
+GERACAO_MAX_VERTICES = int(os.environ.get("GERACAO_MAX_VERTICES", "1000000"))
+SESSAO_CRIADA_TTL = float(os.environ.get("SESSAO_CRIADA_TTL", "3600"))  # Links never connected
+SESSAO_DESCONECTADA_TTL = float(os.environ.get("SESSAO_DESCONECTADA_TTL", "86400"))  # Window to reconnect with session_id
+COMPACTACAO_INTERVALO = float(os.environ.get("COMPACTACAO_INTERVALO", "300"))  # 0 disables the background compaction
+COMPACTACAO_LOTE = int(os.environ.get("COMPACTACAO_LOTE", "500"))
+COMPACTACAO_MODO = os.environ.get("COMPACTACAO_MODO", "arquivar")  # "arquivar" or "apagar"
+LOG_RETENCAO = float(os.environ.get("LOG_RETENCAO", "3600"))  # Seconds of moves kept for live-feed catch-up
+DESLIGAMENTO_PRAZO = float(os.environ.get("DESLIGAMENTO_PRAZO", "10"))  # Seconds to drain connections on shutdown
+RECONEXAO_ESPALHAMENTO = float(os.environ.get("RECONEXAO_ESPALHAMENTO", "5"))  # Spread of the reconnect hints, in seconds
+GRAVACAO_ARQUIVO = os.environ.get("GRAVACAO_ARQUIVO", "")  # Empty disables the traffic recorder
+GRAVACAO_PAYLOADS = os.environ.get("GRAVACAO_PAYLOADS", "1") == "1"  # "0" keeps only sizes and hashes
+GRAVACAO_MAX_CORPO = int(os.environ.get("GRAVACAO_MAX_CORPO", str(64 * 1024)))  # Larger payloads are hashed
+# Comma-separated public websocket base URLs, one per worker, e.g. "ws://host:8001,ws://host:8002"
+WORKERS_ROTEAMENTO = [url.strip().rstrip("/") for url in os.environ.get("WORKERS_ROTEAMENTO", "").split(",") if url.strip()]
+WORKER_ID = int(os.environ.get("WORKER_ID", "0"))  # Position of this process in WORKERS_ROTEAMENTO
+ROTEAMENTO_CHAVE = os.environ.get("ROTEAMENTO_CHAVE", "labirinto")  # "labirinto" or "sessao"
+
 # Database setup
 engine = create_engine(
-    'sqlite:///./db.sqlite3',
+    DATABASE_URL,
     pool_size=200,  # Increase pool size
     max_overflow=200,  # Increase max overflow
     pool_timeout=60,  # Increase timeout
     pool_recycle=3600,  # Recycle connections after 1 hour
-    echo=True
+    echo=DB_ECHO
 )
-Base.metadata.create_all(engine)
 
 SessionLocal = sessionmaker(bind=engine)
 
+def migrar_banco():
+    # Schema work runs here, at startup or through "python main.py migrar", never on import
+    Base.metadata.create_all(engine)
+    adicionar_colunas_faltantes()
+    migrar_historicos()
+
+def adicionar_colunas_faltantes():
+    # create_all only creates missing tables; columns and indexes added to existing models land here
+    inspetor = inspect(engine)
+    with engine.begin() as conexao:
+        for tabela in Base.metadata.sorted_tables:
+            existentes = {coluna["name"] for coluna in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in existentes:
+                    tipo = coluna.type.compile(dialect=engine.dialect)
+                    conexao.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}"))
+            indices = {indice["name"] for indice in inspetor.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name not in indices:
+                    indice.create(conexao)
+
+def migrar_historicos(lote: int = 500):
+    # Re-encodes comma-separated histories into chunks, one batch per transaction
+    db = SessionLocal()
+    try:
+        while True:
+            histories = db.query(MovementHistory)\
+                .filter(MovementHistory.vertex_sequence.isnot(None))\
+                .limit(lote)\
+                .all()
+            if not histories:
+                break
+            for h in histories:
+                h.move_count = 0
+                h.ultimo_vertice = None
+                h.ultimo_instante = None
+                # Legacy sequences carry no times, so their chunks are left without them
+                anexar_movimentos(db, h, [int(x) for x in h.vertex_sequence.split(',') if x.strip()])
+                db.flush()
+                db.query(MovementChunk)\
+                    .filter(MovementChunk.history_id == h.id)\
+                    .update({"tempo_base": None, "tempos": None}, synchronize_session=False)
+                h.ultimo_instante = None
+                h.vertex_sequence = None
+            db.commit()
+    finally:
+        db.close()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -197,7 +1896,684 @@ def get_db():
     finally:
         db.close()
 
-app = FastAPI()
+# Movement history encoding
+CHUNK_MOVIMENTOS = 256
+
+def codificar_varints(vertices, base: int = 0) -> bytes:
+    dados = bytearray()
+    anterior = base
+    for vertice in vertices:
+        delta = vertice - anterior
+        anterior = vertice
+        valor = delta << 1 if delta >= 0 else ((-delta) << 1) - 1  # zigzag
+        while valor >= 0x80:
+            dados.append((valor & 0x7F) | 0x80)
+            valor >>= 7
+        dados.append(valor)
+    return bytes(dados)
+
+def decodificar_varints(dados: bytes, base: int = 0) -> list:
+    vertices = []
+    anterior = base
+    valor = deslocamento = 0
+    for byte in dados:
+        valor |= (byte & 0x7F) << deslocamento
+        if byte & 0x80:
+            deslocamento += 7
+            continue
+        anterior += (valor >> 1) if not valor & 1 else -((valor + 1) >> 1)
+        vertices.append(anterior)
+        valor = deslocamento = 0
+    return vertices
+
+def agora_ms() -> int:
+    return int(time.time() * 1000)
+
+def anexar_movimentos(db, history: MovementHistory, vertices: list, instantes: Optional[list] = None):
+    # Only the last, partially filled chunk is rewritten; earlier chunks are never touched.
+    # instantes holds one Unix ms time per vertex and defaults to now
+    if history.id is None:
+        db.flush()
+    if instantes is None:
+        instantes = [agora_ms()] * len(vertices)
+    contagem = history.move_count or 0
+    while vertices:
+        indice, ocupados = divmod(contagem, CHUNK_MOVIMENTOS)
+        livres = CHUNK_MOVIMENTOS - ocupados
+        parte, vertices = vertices[:livres], vertices[livres:]
+        parte_instantes, instantes = instantes[:livres], instantes[livres:]
+        base = history.ultimo_vertice or 0
+        tempo_base = history.ultimo_instante or parte_instantes[0]
+        if ocupados:
+            chunk = db.get(MovementChunk, (history.id, indice))
+            chunk.dados += codificar_varints(parte, base)
+            chunk.quantidade += len(parte)
+            if chunk.tempos is not None:
+                chunk.tempos += codificar_varints(parte_instantes, tempo_base)
+        else:
+            db.add(MovementChunk(
+                history_id=history.id,
+                indice=indice,
+                base=base,
+                quantidade=len(parte),
+                dados=codificar_varints(parte, base),
+                tempo_base=tempo_base,
+                tempos=codificar_varints(parte_instantes, tempo_base)
+            ))
+        contagem += len(parte)
+        history.ultimo_vertice = parte[-1]
+        history.ultimo_instante = parte_instantes[-1]
+    history.move_count = contagem
+
+def carregar_sequencias(db, histories: list) -> dict:
+    # One query for the chunks of a whole page of histories: {history_id: [vertices]}
+    sequencias = {h.id: [] for h in histories}
+    for h in histories:
+        if h.vertex_sequence:
+            sequencias[h.id] = [int(x) for x in h.vertex_sequence.split(',') if x.strip()]
+    ids = [h.id for h in histories if not h.vertex_sequence and h.move_count]
+    if ids:
+        chunks = db.query(MovementChunk.history_id, MovementChunk.base, MovementChunk.dados)\
+            .filter(MovementChunk.history_id.in_(ids))\
+            .order_by(MovementChunk.history_id, MovementChunk.indice)
+        for history_id, base, dados in chunks:
+            sequencias[history_id].extend(decodificar_varints(dados, base))
+    return sequencias
+
+def decodificar_historico(db, history: MovementHistory) -> list:
+    return carregar_sequencias(db, [history])[history.id]
+
+def decodificar_instantes(db, history: MovementHistory) -> list:
+    # Unix ms per move, aligned with decodificar_historico; None where a chunk predates timing
+    instantes = []
+    chunks = db.query(MovementChunk.quantidade, MovementChunk.tempo_base, MovementChunk.tempos)\
+        .filter(MovementChunk.history_id == history.id)\
+        .order_by(MovementChunk.indice)
+    for quantidade, tempo_base, tempos in chunks:
+        decodificados = decodificar_varints(tempos, tempo_base) if tempos is not None else []
+        instantes.extend(decodificados + [None] * (quantidade - len(decodificados)))
+    return instantes
+
+def com_sequencias(db, histories, lote: int):
+    # Pairs each streamed history with its decoded path, decoding a batch at a time
+    pendentes = []
+    for h in histories:
+        pendentes.append(h)
+        if len(pendentes) >= lote:
+            sequencias = carregar_sequencias(db, pendentes)
+            yield from ((p, sequencias[p.id]) for p in pendentes)
+            pendentes = []
+    if pendentes:
+        sequencias = carregar_sequencias(db, pendentes)
+        yield from ((p, sequencias[p.id]) for p in pendentes)
+
+roteador = Roteador(WORKERS_ROTEAMENTO, WORKER_ID, ROTEAMENTO_CHAVE)
+manager = ConnectionManager()
+live_feed = LiveFeed(compartilhado=roteador.ativo)
+timer_wheel = TimerWheel(resolucao=REAPER_INTERVALO)
+grafos = GrafoCache(revalidar_sempre=roteador.ativo)
+# Format: {labirinto_id: asyncio.Lock} held by an edit from its first query to the snapshot swap
+travas_edicao = {}
+jobs = JobExecutor(JOB_WORKERS)
+placar_hub = PlacarHub(PLACAR_INTERVALO, compartilhado=roteador.ativo)
+progresso = ProgressoBuffer(PROGRESSO_INTERVALO)
+heatmap = HeatmapBuffer(HEATMAP_INTERVALO)
+admissao = AdmissionControl(
+    max_conexoes=MAX_CONEXOES,
+    max_fila=MAX_FILA_CONEXOES,
+    espera_fila=ESPERA_FILA_CONEXOES,
+    max_sessoes_grupo=MAX_SESSOES_GRUPO,
+    max_sessoes_labirinto=MAX_SESSOES_LABIRINTO,
+    taxa_sessao=MOVIMENTOS_POR_SEGUNDO,
+    rajada_sessao=RAJADA_MOVIMENTOS,
+    taxa_grupo=MOVIMENTOS_POR_SEGUNDO_GRUPO,
+    rajada_grupo=RAJADA_MOVIMENTOS_GRUPO
+)
+response_cache = ResponseCache(CACHE_MAX_BYTES, compartilhado=roteador.ativo)
+entidades = EntidadeCache(ENTIDADES_MAX, compartilhado=roteador.ativo)
+desligamento = Desligamento(DESLIGAMENTO_PRAZO, RECONEXAO_ESPALHAMENTO)
+gravador = None
+if GRAVACAO_ARQUIVO:
+    # Each worker of a cluster writes its own file
+    gravador = GravadorTrafego(
+        f"{GRAVACAO_ARQUIVO}.{WORKER_ID}" if roteador.ativo else GRAVACAO_ARQUIVO,
+        GRAVACAO_PAYLOADS,
+        GRAVACAO_MAX_CORPO
+    )
+
+async def encerrar_por_inatividade(websocket: WebSocket):
+    try:
+        await websocket.send_text("Conexão encerrada por inatividade.")
+        await websocket.close(code=1000, reason="Inatividade")
+    except Exception:
+        # The peer is already gone; the handler's cleanup still runs on disconnect
+        pass
+
+async def reaper_sessoes():
+    while True:
+        await asyncio.sleep(REAPER_INTERVALO)
+        expirados = timer_wheel.avancar(time.monotonic())
+        if expirados:
+            await asyncio.gather(*(encerrar_por_inatividade(ws) for ws in expirados))
+
+async def compactacao_periodica():
+    while True:
+        await asyncio.sleep(COMPACTACAO_INTERVALO)
+        try:
+            await asyncio.to_thread(podar_log_movimentos)
+            await asyncio.to_thread(compactar_sessoes, COMPACTACAO_MODO, COMPACTACAO_LOTE)
+        except Exception:
+            traceback.print_exc()
+
+def podar_log_movimentos() -> int:
+    # Ids grow with time, so everything below the first recent row is old; rows from before
+    # the log kept Unix ms times have no instante and go with them. The newest row always
+    # stays, so SQLite never hands out an id that live-feed clients already saw
+    limite = agora_ms() - int(LOG_RETENCAO * 1000)
+    db = SessionLocal()
+    try:
+        primeiro_recente = db.query(MovementLog.id)\
+            .filter(MovementLog.instante >= limite)\
+            .order_by(MovementLog.id)\
+            .limit(1)\
+            .scalar()
+        if primeiro_recente is None:
+            primeiro_recente = db.query(func.max(MovementLog.id)).scalar() or 0
+        apagados = db.query(MovementLog)\
+            .filter(MovementLog.id < primeiro_recente)\
+            .delete(synchronize_session=False)
+        db.commit()
+        return apagados
+    finally:
+        db.close()
+
+def liberar_sessoes_orfas():
+    # A lone worker holds no connections at startup, so "ativa" rows were left by a crash
+    db = SessionLocal()
+    try:
+        db.query(SessaoWebSocket)\
+            .filter(SessaoWebSocket.estado == "ativa")\
+            .update({"estado": "desconectada", "atualizada_em": datetime.datetime.now().isoformat()},
+                    synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def labirintos_para_aquecer() -> list:
+    if WARMUP_LABIRINTOS == "0":
+        return []
+    db = SessionLocal()
+    try:
+        if WARMUP_LABIRINTOS == "todos":
+            labirinto_ids = [lab_id for lab_id, in db.query(Labirinto.id)]
+        else:
+            # Most played first, by number of recorded sessions
+            mais_jogados = db.query(MovementHistory.labirinto_id)\
+                .group_by(MovementHistory.labirinto_id)\
+                .order_by(func.count(MovementHistory.id).desc())\
+                .limit(int(WARMUP_LABIRINTOS))
+            labirinto_ids = [lab_id for lab_id, in mais_jogados]
+    finally:
+        db.close()
+    if roteador.chave == "labirinto":
+        # In a cluster each worker only holds the graphs of the mazes it owns
+        labirinto_ids = [lab_id for lab_id in labirinto_ids if roteador.local(lab_id)]
+    return labirinto_ids
+
+async def aquecer_grafos():
+    loop = asyncio.get_running_loop()
+    try:
+        labirinto_ids = await loop.run_in_executor(None, labirintos_para_aquecer)
+    except Exception as erro:
+        # Without the list nothing is preloaded; mazes still load on first use
+        traceback.print_exc()
+        grafos.aquecimento_erros["lista"] = f"{type(erro).__name__}: {erro}"
+        labirinto_ids = []
+    await loop.run_in_executor(None, grafos.aquecer, labirinto_ids, WARMUP_WORKERS)
+
+# Procedural maze generation, ported from the scripts in labirintos/
+TOPOLOGIAS = ("arvore", "caminhos", "grade")
+
+def gerar_estrutura(num_vertices: int, num_saidas: int, direcional: bool, com_peso: bool,
+                    seed: Optional[int], topologia: str):
+    # Returns (tipos, arestas) with tipos[v] per vertex and arestas {(origem, destino): peso}
+    rng = random.Random(seed)
+    tipos = [0] * num_vertices
+    tipos[0] = 1  # Entrada (sempre o vértice 0)
+    saidas = rng.sample(range(1, num_vertices), num_saidas)
+    for saida in saidas:
+        tipos[saida] = 2
+
+    arestas = {}
+
+    def ligar(origem: int, destino: int):
+        if origem == destino or (origem, destino) in arestas:
+            return
+        arestas[(origem, destino)] = rng.randint(1, 20) if com_peso else 1
+        if not direcional and (destino, origem) not in arestas:
+            arestas[(destino, origem)] = rng.randint(1, 20) if com_peso else 1
+
+    if topologia == "arvore":
+        # Random spanning tree rooted at the entrance
+        na_arvore = [0]
+        restantes = list(range(1, num_vertices))
+        rng.shuffle(restantes)
+        for destino in restantes:
+            ligar(rng.choice(na_arvore), destino)
+            na_arvore.append(destino)
+    elif topologia == "caminhos":
+        # One random simple path from the entrance to each exit
+        for saida in saidas:
+            tamanho = min(rng.randint(2, num_vertices) - 1, num_vertices - 2)
+            intermediarios = [v for v in rng.sample(range(1, num_vertices), min(tamanho + 1, num_vertices - 1)) if v != saida]
+            caminho = [0] + intermediarios[:tamanho] + [saida]
+            for origem, destino in zip(caminho, caminho[1:]):
+                ligar(origem, destino)
+    else:
+        # Perfect maze on a square grid, carved with a randomized depth-first search
+        lado = math.isqrt(num_vertices - 1) + 1
+        visitados = bytearray(num_vertices)
+        visitados[0] = 1
+        pilha = [0]
+        while pilha:
+            atual = pilha[-1]
+            linha, coluna = divmod(atual, lado)
+            vizinhos = [
+                v for v, valido in (
+                    (atual - lado, linha > 0), (atual + lado, True),
+                    (atual - 1, coluna > 0), (atual + 1, coluna < lado - 1)
+                ) if valido and v < num_vertices and not visitados[v]
+            ]
+            if not vizinhos:
+                pilha.pop()
+                continue
+            proximo = rng.choice(vizinhos)
+            visitados[proximo] = 1
+            ligar(atual, proximo)
+            pilha.append(proximo)
+        # Vertices beyond the last full row may be unreachable from the grid; hang them off the tree
+        for v in range(num_vertices):
+            if not visitados[v]:
+                ligar(rng.randrange(v), v)
+
+    if direcional:
+        # Every vertex can walk back to the entrance, as in the original scripts
+        for vertice in range(1, num_vertices):
+            ligar(vertice, 0)
+
+    if topologia != "grade":
+        # Extra edges so the maze has cycles
+        for origem in range(num_vertices):
+            for destino in rng.sample(range(num_vertices), rng.randint(1, min(3, num_vertices - 1))):
+                ligar(origem, destino)
+    else:
+        for _ in range(num_vertices // 10):
+            v = rng.randrange(num_vertices)
+            vizinho = v + (1 if rng.random() < 0.5 else lado)
+            if vizinho < num_vertices and (vizinho != v + 1 or vizinho % lado):
+                ligar(v, vizinho)
+
+    return tipos, arestas
+
+def gerar_labirinto(parametros: dict) -> int:
+    # Runs in the process pool: generated straight into the tables and the snapshot, no JSON
+    geracao = GeracaoLabirintoDto(**parametros)
+    tipos, arestas = gerar_estrutura(
+        geracao.vertices, geracao.saidas, geracao.direcional,
+        geracao.com_peso, geracao.seed, geracao.topologia
+    )
+    dificuldade = geracao.dificuldade or ("Basiquinho e pequeno" if geracao.vertices <= 5 else "Intermediario")
+    db = SessionLocal()
+    try:
+        labirinto_id = inserir_labirinto(
+            db,
+            dificuldade,
+            0,
+            list(enumerate(tipos)),
+            [(origem, destino, peso) for (origem, destino), peso in arestas.items()]
+        )
+    finally:
+        db.close()
+
+    adjacencia = {}
+    for (origem, destino), peso in arestas.items():
+        adjacencia.setdefault(origem, []).append((destino, peso))
+    escrever_snapshot(
+        caminho_snapshot(labirinto_id), labirinto_id, 0, dificuldade, dict(enumerate(tipos)), adjacencia
+    )
+    return labirinto_id
+
+# Bulk re-grading of stored paths
+class CorrecaoLabirinto:
+    # What grading needs from a maze: entrance, exits, weighted edge set and optimal cost
+    def __init__(self, grafo: SnapshotLabirinto):
+        self.entrada = grafo.entrada
+        self.saidas = grafo.saidas
+        # Format: {(origem_id, destino_id): peso}
+        self.pesos = {}
+        offsets, destinos, pesos = list(grafo.offsets), list(grafo.destinos), list(grafo.pesos)
+        for i, origem in enumerate(grafo.vertices):
+            for j in range(offsets[i], offsets[i + 1]):
+                self.pesos[(origem, destinos[j])] = pesos[j]
+        posicao, alvos = indexar_grafo(grafo)
+        self.custo_minimo = None
+        if self.entrada in posicao:
+            custos = dijkstra(offsets, list(alvos), pesos, grafo.num_vertices, posicao[self.entrada])
+            alcancaveis = [custos[posicao[s]] for s in self.saidas if s in posicao and custos[posicao[s]] is not None]
+            self.custo_minimo = min(alcancaveis, default=None)
+
+    def corrigir(self, sequencia: list) -> dict:
+        if not sequencia or sequencia[0] != self.entrada:
+            return {"valido": False, "chegou_saida": False, "custo": None, "otimo": False}
+        custo = 0
+        for aresta in zip(sequencia, sequencia[1:]):
+            peso = self.pesos.get(aresta)
+            if peso is None:
+                return {"valido": False, "chegou_saida": False, "custo": None, "otimo": False}
+            custo += peso
+        chegou_saida = sequencia[-1] in self.saidas
+        return {
+            "valido": True,
+            "chegou_saida": chegou_saida,
+            "custo": custo,
+            "otimo": chegou_saida and custo == self.custo_minimo
+        }
+
+def recorrigir_historicos(labirinto_id: Optional[int] = None, lote: int = 1000, ao_progredir=None) -> dict:
+    # Keyset pages of histories; memory is bounded by one page plus a few mazes
+    inicio = time.perf_counter()
+    corretores = OrderedDict()
+    totais = {"processados": 0, "validos": 0, "chegaram_saida": 0, "otimos": 0}
+    db = SessionLocal()
+    try:
+        filtro = [MovementHistory.labirinto_id == labirinto_id] if labirinto_id is not None else []
+        total = db.query(func.count(MovementHistory.id)).filter(*filtro).scalar()
+        ultimo_id = 0
+        while True:
+            histories = db.query(MovementHistory)\
+                .filter(MovementHistory.id > ultimo_id, *filtro)\
+                .order_by(MovementHistory.id)\
+                .limit(lote)\
+                .all()
+            if not histories:
+                break
+            ultimo_id = histories[-1].id
+            sequencias = carregar_sequencias(db, histories)
+            agora = datetime.datetime.now().isoformat()
+            atualizacoes = []
+            for h in histories:
+                corretor = corretores.get(h.labirinto_id)
+                if corretor is None:
+                    grafo = grafos.obter(h.labirinto_id)
+                    corretor = CorrecaoLabirinto(grafo) if grafo else None
+                    corretores[h.labirinto_id] = corretor
+                    if len(corretores) > 8:
+                        corretores.popitem(last=False)
+                else:
+                    corretores.move_to_end(h.labirinto_id)
+                if corretor is None:
+                    nota = {"valido": False, "chegou_saida": False, "custo": None, "otimo": False}
+                else:
+                    nota = corretor.corrigir(sequencias[h.id])
+                atualizacoes.append({"id": h.id, "corrigido_em": agora, **nota})
+                totais["validos"] += nota["valido"]
+                totais["chegaram_saida"] += nota["chegou_saida"]
+                totais["otimos"] += nota["otimo"]
+            db.execute(update(MovementHistory), atualizacoes)
+            db.commit()
+            db.expunge_all()
+            totais["processados"] += len(histories)
+            if ao_progredir and total:
+                ao_progredir(totais["processados"] / total)
+    finally:
+        db.close()
+    totais["segundos"] = round(time.perf_counter() - inicio, 3)
+    return totais
+
+def marcar_sessao(db, session_id: int, estado: str):
+    db.query(SessaoWebSocket)\
+        .filter(SessaoWebSocket.id == session_id)\
+        .update({"estado": estado, "atualizada_em": datetime.datetime.now().isoformat()}, synchronize_session=False)
+    db.commit()
+
+def compactar_sessoes(modo: str = "arquivar", lote: int = 500, ao_progredir=None) -> dict:
+    # Expires stale sessions, then archives or deletes them one batch per transaction
+    if modo not in ("arquivar", "apagar"):
+        raise ValueError(f"Modo de compactação inválido: {modo}")
+    inicio = time.perf_counter()
+    agora = datetime.datetime.now()
+    totais = {"expiradas": 0, "arquivadas": 0, "apagadas": 0, "historicos_apagados": 0}
+    db = SessionLocal()
+    try:
+        limite_criada = (agora - datetime.timedelta(seconds=SESSAO_CRIADA_TTL)).isoformat()
+        limite_desconectada = (agora - datetime.timedelta(seconds=SESSAO_DESCONECTADA_TTL)).isoformat()
+        # Rows written before sessions had a state are leftovers and expire right away
+        totais["expiradas"] = db.query(SessaoWebSocket)\
+            .filter(or_(
+                SessaoWebSocket.estado.is_(None),
+                and_(SessaoWebSocket.estado == "criada", SessaoWebSocket.atualizada_em < limite_criada),
+                and_(SessaoWebSocket.estado == "desconectada", SessaoWebSocket.atualizada_em < limite_desconectada)
+            ))\
+            .update({"estado": "expirada", "atualizada_em": agora.isoformat()}, synchronize_session=False)
+        db.commit()
+
+        # SQLite hands out max(id) + 1, so keeping the newest row means ids are never reused
+        # by new sessions while histories and archived rows still point at them
+        ultimo_id = db.query(func.max(SessaoWebSocket.id)).scalar() or 0
+        expiradas = [SessaoWebSocket.estado == "expirada", SessaoWebSocket.id < ultimo_id]
+        total = db.query(func.count(SessaoWebSocket.id)).filter(*expiradas).scalar()
+        processadas = 0
+        while True:
+            ids = [session_id for session_id, in db.query(SessaoWebSocket.id)
+                   .filter(*expiradas)
+                   .order_by(SessaoWebSocket.id)
+                   .limit(lote)]
+            if not ids:
+                break
+            if modo == "arquivar":
+                # Played sessions are kept apart from the hot table; empty ones are just dropped
+                com_historico = select(MovementHistory.session_id).where(MovementHistory.session_id.in_(ids))
+                arquivadas = db.execute(insert(SessaoArquivada).from_select(
+                    ["id", "grupo_id", "conexao", "criada_em", "atualizada_em", "arquivada_em"],
+                    select(
+                        SessaoWebSocket.id, SessaoWebSocket.grupo_id, SessaoWebSocket.conexao,
+                        SessaoWebSocket.criada_em, SessaoWebSocket.atualizada_em, literal(agora.isoformat())
+                    ).where(SessaoWebSocket.id.in_(com_historico))
+                )).rowcount
+                totais["arquivadas"] += arquivadas
+                totais["apagadas"] += len(ids) - arquivadas
+            else:
+                historicos = select(MovementHistory.id).where(MovementHistory.session_id.in_(ids))
+                db.query(MovementChunk)\
+                    .filter(MovementChunk.history_id.in_(historicos))\
+                    .delete(synchronize_session=False)
+                totais["historicos_apagados"] += db.query(MovementHistory)\
+                    .filter(MovementHistory.session_id.in_(ids))\
+                    .delete(synchronize_session=False)
+                totais["apagadas"] += len(ids)
+            db.query(SessaoWebSocket).filter(SessaoWebSocket.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            processadas += len(ids)
+            if ao_progredir and total:
+                ao_progredir(min(processadas / total, 1.0))
+    finally:
+        db.close()
+    totais["segundos"] = round(time.perf_counter() - inicio, 3)
+    return totais
+
+# Background jobs; these run inside the process pool
+def atualizar_job(job_id: str, **campos):
+    campos["atualizado_em"] = datetime.datetime.now().isoformat()
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id == job_id).update(campos)
+        db.commit()
+    finally:
+        db.close()
+
+def job_ingestao(job_id: str, parametros: dict) -> dict:
+    labirinto = LabirintoModel(**parametros)
+    atualizar_job(job_id, progresso=0.1)
+    db = SessionLocal()
+    try:
+        labirinto_id = inserir_labirinto(
+            db,
+            labirinto.dificuldade,
+            0,
+            [(v.id, v.tipo) for v in labirinto.vertices],
+            [(a.origemId, a.destinoId, a.peso) for a in labirinto.arestas]
+        )
+        atualizar_job(job_id, progresso=0.8)
+        exportar_snapshot(db, labirinto_id)
+    finally:
+        db.close()
+    return {"LabirintoId": labirinto_id}
+
+def obter_grafo_job(parametros: dict):
+    grafo = grafos.obter(int(parametros["labirinto_id"]))
+    if grafo is None:
+        raise ValueError("Labirinto não encontrado")
+    return grafo
+
+def job_validacao(job_id: str, parametros: dict) -> dict:
+    grafo = obter_grafo_job(parametros)
+    offsets = list(grafo.offsets)
+    posicao, alvos = indexar_grafo(grafo)
+    entrada = posicao.get(grafo.entrada)
+    if entrada is None:
+        return {"valido": False, "motivo": "Vértice de entrada não encontrado"}
+    niveis = bfs_niveis(offsets, list(alvos), grafo.num_vertices, entrada)
+    inalcancaveis = [grafo.vertices[i] for i in range(grafo.num_vertices) if niveis[i] < 0]
+    saidas_alcancaveis = sorted(s for s in grafo.saidas if s in posicao and niveis[posicao[s]] >= 0)
+    return {
+        "valido": bool(saidas_alcancaveis),
+        "todos_alcancaveis": not inalcancaveis,
+        "inalcancaveis": inalcancaveis[:1000],
+        "saidas_alcancaveis": saidas_alcancaveis
+    }
+
+def job_caminhos(job_id: str, parametros: dict) -> dict:
+    grafo = obter_grafo_job(parametros)
+    n = grafo.num_vertices
+    posicao, alvos = indexar_grafo(grafo)
+    entrada = posicao.get(grafo.entrada)
+    if entrada is None:
+        return {"caminhos": []}
+    anteriores = [-1] * n
+    custos = dijkstra(list(grafo.offsets), list(alvos), list(grafo.pesos), n, entrada, anteriores)
+    caminhos = []
+    for saida in sorted(grafo.saidas):
+        i = posicao.get(saida)
+        if i is None or custos[i] is None:
+            caminhos.append({"saida": saida, "custo": None, "vertices": []})
+            continue
+        caminho = [i]
+        while caminho[-1] != entrada:
+            caminho.append(anteriores[caminho[-1]])
+        caminhos.append({
+            "saida": saida,
+            "custo": custos[i],
+            "vertices": [grafo.vertices[j] for j in reversed(caminho)]
+        })
+    return {"caminhos": caminhos}
+
+def job_snapshot(job_id: str, parametros: dict) -> dict:
+    db = SessionLocal()
+    try:
+        # Always the served location; custom output paths are only offered by snapshot_cli.py
+        caminho = exportar_snapshot(db, int(parametros["labirinto_id"]))
+    finally:
+        db.close()
+    if caminho is None:
+        raise ValueError("Labirinto não encontrado")
+    return {"arquivo": caminho}
+
+def job_analise(job_id: str, parametros: dict) -> dict:
+    return analisar_grafo(obter_grafo_job(parametros))
+
+def job_geracao(job_id: str, parametros: dict) -> dict:
+    return {"LabirintoId": gerar_labirinto(parametros)}
+
+def job_recorrigir(job_id: str, parametros: dict) -> dict:
+    labirinto_id = parametros.get("labirinto_id")
+    return recorrigir_historicos(
+        int(labirinto_id) if labirinto_id is not None else None,
+        int(parametros.get("lote", 1000)),
+        lambda fracao: atualizar_job(job_id, progresso=round(fracao, 3))
+    )
+
+def job_compactacao(job_id: str, parametros: dict) -> dict:
+    return compactar_sessoes(
+        parametros.get("modo", COMPACTACAO_MODO),
+        int(parametros.get("lote", COMPACTACAO_LOTE)),
+        lambda fracao: atualizar_job(job_id, progresso=round(fracao, 3))
+    )
+
+JOBS = {
+    "ingestao": job_ingestao,
+    "validacao": job_validacao,
+    "caminhos": job_caminhos,
+    "snapshot": job_snapshot,
+    "analise": job_analise,
+    "geracao": job_geracao,
+    "recorrigir": job_recorrigir,
+    "compactacao": job_compactacao
+}
+
+def executar_job(job_id: str):
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        tipo, parametros = job.tipo, json.loads(job.parametros)
+    finally:
+        db.close()
+
+    atualizar_job(job_id, estado="executando")
+    try:
+        resultado = JOBS[tipo](job_id, parametros)
+    except Exception as e:
+        atualizar_job(job_id, estado="falhou", erro="".join(traceback.format_exception_only(e)).strip())
+        return tipo, None
+    atualizar_job(job_id, estado="concluido", progresso=1.0, resultado=json.dumps(resultado))
+    return tipo, resultado
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRAR_NA_INICIALIZACAO:
+        migrar_banco()
+    if not roteador.ativo:
+        liberar_sessoes_orfas()
+    aquecimento = asyncio.create_task(aquecer_grafos())
+    reaper = asyncio.create_task(reaper_sessoes())
+    transmissao_placar = asyncio.create_task(placar_hub.transmitir())
+    gravacao_progresso = asyncio.create_task(progresso.executar())
+    gravacao_heatmap = asyncio.create_task(heatmap.executar())
+    # Only one worker of a cluster requeues interrupted jobs and compacts sessions
+    jobs.iniciar(retomar=roteador.worker_id == 0)
+    compactacao = None
+    if COMPACTACAO_INTERVALO and roteador.worker_id == 0:
+        compactacao = asyncio.create_task(compactacao_periodica())
+    sincronizacao_feed = None
+    if roteador.ativo:
+        sincronizacao_feed = asyncio.create_task(live_feed.sincronizar(AO_VIVO_INTERVALO_CLUSTER))
+    yield
+    await desligamento.drenar()
+    if compactacao:
+        compactacao.cancel()
+    if sincronizacao_feed:
+        sincronizacao_feed.cancel()
+    if gravador:
+        gravador.fechar()
+    jobs.encerrar()
+    gravacao_progresso.cancel()
+    progresso.descarregar()
+    gravacao_heatmap.cancel()
+    heatmap.descarregar()
+    transmissao_placar.cancel()
+    reaper.cancel()
+    aquecimento.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -206,8 +2582,91 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if gravador:
+    app.add_middleware(MiddlewareGravacao, gravador=gravador)
+
+STREAM_LOTE = 500  # Rows fetched per round trip by streamed list responses
+HISTORICOS_PAGINA_MAX = 500
+FORMATOS_HISTORICO = ("lista", "deltas")
+STREAM_BUFFER = 64 * 1024  # Bytes accumulated before a streamed chunk is sent
+SSE_CHUNK = 500  # Rows read from the movement log per query
+SSE_KEEPALIVE = 15.0  # Seconds between keep-alive comments on idle streams
+REPLAY_MAX_PAUSA = 5.0  # Longest pause between replayed moves, in seconds
+
+def resposta_em_cache(request: Request, dependencias: list, gerar) -> Response:
+    chave = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    versoes = response_cache.versoes_atuais(dependencias)
+    entrada = response_cache.obter(chave, versoes)
+    if entrada is None:
+        corpo = orjson.dumps(gerar())
+        entrada = response_cache.guardar(chave, versoes, corpo)
+
+    _, corpo, etag = entrada
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in etags or "*" in etags:
+            return Response(status_code=304, headers={"ETag": etag})
+    return Response(corpo, media_type="application/json", headers={"ETag": etag})
+
+def stream_json_lista(chave: str, linhas):
+    # Writes {"<chave>": [...]} one row at a time; memory stays bounded by STREAM_BUFFER
+    buffer = bytearray(b"{" + orjson.dumps(chave) + b":[")
+    separador = b""
+    for linha in linhas:
+        buffer += separador
+        buffer += orjson.dumps(linha)
+        separador = b","
+        if len(buffer) >= STREAM_BUFFER:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]}"
+    yield bytes(buffer)
+
+def grupo_dto(grupo_id, nome: str, labirintos_concluidos: Optional[str]) -> dict:
+    return {
+        "id": str(grupo_id),
+        "nome": nome,
+        "labirintos_concluidos": [int(x) for x in labirintos_concluidos.split(",") if x.strip()]
+        if labirintos_concluidos else []
+    }
 
-manager = ConnectionManager()
+def history_dto(h, sequencia: list, formato: str = "lista") -> dict:
+    # "lista" sends the vertices comma-separated in "moves"; "deltas" sends codificar_deltas in "deltas"
+    return {
+        "id": h.id,
+        "session_id": h.session_id,
+        "grupo_id": str(h.grupo_id),
+        **({"deltas": codificar_deltas(sequencia)} if formato == "deltas" else {"moves": ",".join(map(str, sequencia))}),
+        "timestamp": h.timestamp,
+        "valido": h.valido,
+        "chegou_saida": h.chegou_saida,
+        "custo": h.custo,
+        "otimo": h.otimo
+    }
+
+def codificar_deltas(sequencia: List[int]) -> List[int]:
+    # First vertex followed by the difference to the previous one
+    return [v - (sequencia[i - 1] if i else 0) for i, v in enumerate(sequencia)]
+
+def evento_sse(evento: str, dados: dict, event_id: Optional[int] = None) -> str:
+    linhas = f"id: {event_id}\n" if event_id is not None else ""
+    return linhas + f"event: {evento}\ndata: {json.dumps(dados)}\n\n"
+
+def movimento_dto(log: MovementLog, grupo_id) -> dict:
+    return {
+        "id": log.id,
+        "session_id": log.session_id,
+        "grupo_id": str(grupo_id) if grupo_id else None,
+        "passo": log.passo,
+        "vertice": log.vertice_id,
+        "timestamp": instante_iso(log.instante)
+    }
+
+def instante_iso(instante: Optional[int]) -> Optional[str]:
+    if instante is None:
+        return None
+    return datetime.datetime.fromtimestamp(instante / 1000).isoformat()
 
 @app.post("/grupo")
 async def registrar_grupo(grupo: CriarGrupoDto):
@@ -215,10 +2674,14 @@ async def registrar_grupo(grupo: CriarGrupoDto):
     grupo_id = uuid.uuid4()
     grupo_db = Grupo(id=grupo_id, nome=grupo.nome)
     db.add(grupo_db)
-    for labirinto in db.query(Labirinto).all():
-        info_grupo = InfoGrupo(grupo_id=grupo_id, labirinto_id=labirinto.id, passos=0, exploracao=0)
+    labirinto_ids = [lab_id for lab_id, in db.query(Labirinto.id)]
+    for labirinto_id in labirinto_ids:
+        info_grupo = InfoGrupo(grupo_id=grupo_id, labirinto_id=labirinto_id, passos=0, exploracao=0, concluido=False)
         db.add(info_grupo)
     db.commit()
+    response_cache.invalidar("grupos", ("placar", grupo_id))
+    for labirinto_id in labirinto_ids:
+        placar_hub.publicar(grupo_id, labirinto_id, grupo=grupo.nome, passos=0, exploracao=0.0, concluido=False)
     grupo_dto = GrupoDto(id=grupo_db.id, nome=grupo_db.nome, labirintos_concluidos=[])
     return {"GrupoId": grupo_dto.id}
 
@@ -250,36 +2713,186 @@ async def criar_labirinto(labirinto: LabirintoModel):
         db.add(aresta_db)
 
     db.commit()
+    exportar_snapshot(db, labirinto_db.id)
+    response_cache.invalidar("labirintos", ("labirinto", labirinto_db.id))
     return {"LabirintoId": labirinto_db.id}
 
-@app.get("/grupos")
-async def retorna_grupos():
+def ler_coluna(corpo: dict, secao: str, campo: str) -> array:
+    valores = (corpo.get(secao) or {}).get(campo)
+    if not isinstance(valores, list):
+        raise HTTPException(status_code=422, detail=f"{secao}.{campo} deve ser uma lista de inteiros.")
+    try:
+        # array() checks types and the 32-bit range in C, without one object per element
+        return array("i", valores)
+    except (TypeError, OverflowError):
+        raise HTTPException(status_code=422, detail=f"{secao}.{campo} deve conter apenas inteiros de 32 bits.")
+
+@app.post("/labirinto/colunar")
+async def criar_labirinto_colunar(request: Request):
+    # Parsed with orjson into plain lists; no per-vertex or per-edge Pydantic model
+    try:
+        corpo = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=422, detail="JSON inválido.")
+    if not isinstance(corpo, dict) or not isinstance(corpo.get("dificuldade"), str):
+        raise HTTPException(status_code=422, detail="dificuldade deve ser um texto.")
+
+    ids = ler_coluna(corpo, "vertices", "ids")
+    tipos = ler_coluna(corpo, "vertices", "tipos")
+    origens = ler_coluna(corpo, "arestas", "origens")
+    destinos = ler_coluna(corpo, "arestas", "destinos")
+    pesos = ler_coluna(corpo, "arestas", "pesos")
+    entrada = corpo.get("entrada", 0)
+    dificuldade = corpo["dificuldade"]
+    del corpo
+    # bool is an int subclass and 1.0 == 1; both would pass the membership check below
+    if type(entrada) is not int:
+        raise HTTPException(status_code=422, detail="entrada deve ser um inteiro.")
+
+    if len(ids) != len(tipos):
+        raise HTTPException(status_code=400, detail="vertices.ids e vertices.tipos devem ter o mesmo tamanho.")
+    if not len(origens) == len(destinos) == len(pesos):
+        raise HTTPException(status_code=400, detail="arestas.origens, arestas.destinos e arestas.pesos devem ter o mesmo tamanho.")
+    if tipos and (min(tipos) < 0 or max(tipos) > 2):
+        raise HTTPException(status_code=400, detail="vertices.tipos aceita apenas 0, 1 e 2.")
+    if pesos and min(pesos) < 0:
+        raise HTTPException(status_code=400, detail="arestas.pesos não aceita valores negativos.")
+    conjunto_ids = set(ids)
+    if len(conjunto_ids) != len(ids):
+        raise HTTPException(status_code=400, detail="vertices.ids contém ids repetidos.")
+    if entrada not in conjunto_ids:
+        raise HTTPException(status_code=400, detail="O vértice de entrada não existe.")
+    if not conjunto_ids.issuperset(origens) or not conjunto_ids.issuperset(destinos):
+        raise HTTPException(status_code=400, detail="Há arestas apontando para vértices inexistentes.")
+    if len(set(zip(origens, destinos))) != len(origens):
+        raise HTTPException(status_code=400, detail="Há arestas repetidas.")
+
     db = next(get_db())
-    grupos = db.query(Grupo).all()
-    grupos_dto = [GrupoDto(
-        id=grupo.id,
-        nome=grupo.nome,
-        labirintos_concluidos=grupo.labirintos_concluidos.split(",") if grupo.labirintos_concluidos else []
-    ) for grupo in grupos]
-    return {"Grupos": grupos_dto}
+    try:
+        labirinto_id = inserir_labirinto(
+            db, dificuldade, entrada, list(zip(ids, tipos)), list(zip(origens, destinos, pesos))
+        )
+    finally:
+        db.close()
+
+    adjacencia = {}
+    for origem, destino, peso in zip(origens, destinos, pesos):
+        adjacencia.setdefault(origem, []).append((destino, peso))
+    escrever_snapshot(
+        caminho_snapshot(labirinto_id), labirinto_id, entrada, dificuldade, dict(zip(ids, tipos)), adjacencia
+    )
+    response_cache.invalidar("labirintos")
+    return {"LabirintoId": labirinto_id}
+
+@app.post("/labirinto/gerar")
+async def criar_labirinto_gerado(geracao: GeracaoLabirintoDto):
+    if not 2 <= geracao.vertices <= GERACAO_MAX_VERTICES:
+        raise HTTPException(status_code=400, detail=f"O número de vértices deve estar entre 2 e {GERACAO_MAX_VERTICES}.")
+    if not 1 <= geracao.saidas < geracao.vertices:
+        raise HTTPException(status_code=400, detail="O número de saídas deve estar entre 1 e vertices - 1.")
+    if geracao.topologia not in TOPOLOGIAS:
+        raise HTTPException(status_code=400, detail=f"Topologia inválida. Use uma de: {', '.join(TOPOLOGIAS)}")
+
+    loop = asyncio.get_running_loop()
+    labirinto_id = await loop.run_in_executor(jobs.pool, gerar_labirinto, geracao.model_dump())
+    response_cache.invalidar("labirintos")
+    grafo = grafos.obter(labirinto_id)
+    return {"LabirintoId": labirinto_id, "vertices": grafo.num_vertices, "arestas": grafo.num_arestas}
+
+@app.get("/grupos")
+async def retorna_grupos(
+    request: Request,
+    apos: Optional[UUID] = None,
+    limite: Optional[int] = None,
+    stream: bool = False
+):
+    colunas = (Grupo.id, Grupo.nome, Grupo.labirintos_concluidos)
+
+    if stream:
+        def linhas():
+            db = next(get_db())
+            try:
+                query = db.query(*colunas).order_by(Grupo.id)
+                if apos:
+                    query = query.filter(Grupo.id > apos)
+                for grupo in query.yield_per(STREAM_LOTE):
+                    yield grupo_dto(*grupo)
+            finally:
+                db.close()
+
+        return StreamingResponse(stream_json_lista("Grupos", linhas()), media_type="application/json")
+
+    if limite is not None:
+        limite = max(1, min(limite, 1000))
+
+        def gerar_pagina():
+            db = next(get_db())
+            try:
+                query = db.query(*colunas).order_by(Grupo.id)
+                if apos:
+                    query = query.filter(Grupo.id > apos)
+                grupos = query.limit(limite).all()
+                return {
+                    "Grupos": [grupo_dto(*grupo) for grupo in grupos],
+                    "Proximo": str(grupos[-1].id) if len(grupos) == limite else None
+                }
+            finally:
+                db.close()
+
+        return resposta_em_cache(request, ["grupos"], gerar_pagina)
+
+    def gerar():
+        db = next(get_db())
+        try:
+            # Plain tuples straight into dicts; no ORM instances or per-row DTO validation
+            grupos = db.query(*colunas).all()
+            return {"Grupos": [grupo_dto(*grupo) for grupo in grupos]}
+        finally:
+            db.close()
+
+    return resposta_em_cache(request, ["grupos"], gerar)
 
 @app.get("/labirintos")
-async def get_labirintos():
-    db = next(get_db())
-    labirintos = db.query(Labirinto).all()
-    lista_labirintos = [
-        RetornaLabirintosDto(labirinto=lab.id, dificuldade=lab.dificuldade)
-        for lab in labirintos
-    ]
-    return {"labirintos": lista_labirintos}
+async def get_labirintos(request: Request):
+    def gerar():
+        db = next(get_db())
+        try:
+            labirintos = db.query(Labirinto.id, Labirinto.dificuldade).all()
+            lista_labirintos = [
+                {"labirinto": lab_id, "dificuldade": dificuldade}
+                for lab_id, dificuldade in labirintos
+            ]
+            return {"labirintos": lista_labirintos}
+        finally:
+            db.close()
+
+    return resposta_em_cache(request, ["labirintos"], gerar)
+
+@app.get("/ready")
+async def get_ready():
+    pronto = grafos.pronto and not desligamento.encerrando
+    estado = {
+        "pronto": pronto,
+        "encerrando": desligamento.encerrando,
+        "labirintos_carregados": grafos.aquecimento_carregados,
+        "labirintos_total": grafos.aquecimento_total,
+        "erros_aquecimento": {str(chave): erro for chave, erro in list(grafos.aquecimento_erros.items())[:20]}
+    }
+    return FastJSONResponse(estado, status_code=200 if pronto else 503)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return response_cache.estatisticas()
 
 
 @app.get("/sessoes")
-async def get_websocket_sessions(nome_grupo: Optional[str] = None):
+async def get_websocket_sessions(nome_grupo: Optional[str] = None, estado: Optional[str] = None):
     db = next(get_db())
     try:
         # Basic query for sessions
         query = db.query(SessaoWebSocket)
+        if estado:
+            query = query.filter(SessaoWebSocket.estado == estado)
 
         # Join with Grupo if we need to filter by name
         if nome_grupo:
@@ -302,33 +2915,239 @@ async def get_websocket_sessions(nome_grupo: Optional[str] = None):
                 "id": sessao.id,
                 "grupo_id": str(sessao.grupo_id),
                 "conexao": sessao.conexao,
+                "estado": sessao.estado,
+                "criada_em": sessao.criada_em,
                 "grupo_nome": grupo.nome if grupo else None,
                 "ultima_atividade": history.timestamp if history else None,
-                "moves_count": len(history.vertex_sequence.split(',')) if history and history.vertex_sequence else 0,
+                "moves_count": history.move_count or 0 if history else 0,
                 "labirinto_id": history.labirinto_id if history else None
             }
             result.append(session_data)
 
-        return result
+        return FastJSONResponse(result)
     finally:
         db.close()
 
 @app.get("/session-histories/{labirinto_id}")
-async def get_session_histories(labirinto_id: int):
+async def get_session_histories(
+    labirinto_id: int,
+    apos: int = 0,
+    limite: Optional[int] = None,
+    stream: bool = False,
+    formato: str = "lista"
+):
+    if formato not in FORMATOS_HISTORICO:
+        raise HTTPException(status_code=400, detail=f"Formato inválido. Use um de: {', '.join(FORMATOS_HISTORICO)}")
+
+    if stream:
+        def linhas():
+            db = next(get_db())
+            try:
+                query = db.query(MovementHistory)\
+                    .filter(MovementHistory.labirinto_id == labirinto_id, MovementHistory.id > apos)\
+                    .order_by(MovementHistory.id)
+                for h, sequencia in com_sequencias(db, query.yield_per(STREAM_LOTE), STREAM_LOTE):
+                    yield history_dto(h, sequencia, formato)
+            finally:
+                db.close()
+
+        return StreamingResponse(stream_json_lista("histories", linhas()), media_type="application/json")
+
     db = next(get_db())
-    histories = db.query(MovementHistory).filter_by(labirinto_id=labirinto_id).all()
+    try:
+        query = db.query(MovementHistory)\
+            .filter(MovementHistory.labirinto_id == labirinto_id, MovementHistory.id > apos)\
+            .order_by(MovementHistory.id)
+
+        if limite is None:
+            histories = query.all()
+            sequencias = carregar_sequencias(db, histories)
+            return FastJSONResponse({"histories": [history_dto(h, sequencias[h.id], formato) for h in histories]})
+
+        limite = max(1, min(limite, HISTORICOS_PAGINA_MAX))
+        histories = query.limit(limite).all()
+        sequencias = carregar_sequencias(db, histories)
+        return FastJSONResponse({
+            "histories": [history_dto(h, sequencias[h.id], formato) for h in histories],
+            "proximo": histories[-1].id if len(histories) == limite else None
+        })
+    finally:
+        db.close()
 
-    return {
-        "histories": [
-            {
-                "session_id": h.session_id,
-                "grupo_id": str(h.grupo_id),
-                "moves": h.vertex_sequence,
-                "timestamp": h.timestamp
-            }
-            for h in histories
-        ]
-    }
+@app.get("/session-histories/{labirinto_id}/pagina")
+async def get_session_histories_pagina(labirinto_id: int, apos: int = 0, limite: int = 50):
+    # Kept for existing clients: the paginated listing above with delta-encoded sequences
+    return await get_session_histories(labirinto_id, apos=apos, limite=limite, formato="deltas")
+
+@app.get("/sessoes/{session_id}/replay")
+async def replay_sessao(session_id: int, velocidade: float = 1.0):
+    if velocidade <= 0:
+        raise HTTPException(status_code=400, detail="Velocidade deve ser positiva")
+
+    db = next(get_db())
+    if not db.query(SessaoWebSocket.id).filter(SessaoWebSocket.id == session_id).first() and \
+            not db.query(SessaoArquivada.id).filter(SessaoArquivada.id == session_id).first():
+        db.close()
+        raise HTTPException(status_code=404, detail="Sessão não encontrada")
+
+    async def eventos():
+        try:
+            # The chunks carry every move's time; chunks written before timing replay at one move per second
+            history = db.query(MovementHistory).filter_by(session_id=session_id).first()
+            sequencia = decodificar_historico(db, history) if history else []
+            instantes = decodificar_instantes(db, history) if history else []
+            grupo_id = str(history.grupo_id) if history else None
+            anterior = None
+            for passo, vertice in enumerate(sequencia):
+                instante = instantes[passo] if passo < len(instantes) else None
+                if passo:
+                    if instante is not None and anterior is not None:
+                        pausa = (instante - anterior) / 1000 / velocidade
+                    else:
+                        pausa = 1.0 / velocidade
+                    await asyncio.sleep(min(max(pausa, 0.0), REPLAY_MAX_PAUSA))
+                anterior = instante
+                yield evento_sse("move", {
+                    "session_id": session_id,
+                    "grupo_id": grupo_id,
+                    "passo": passo,
+                    "vertice": vertice,
+                    "timestamp": instante_iso(instante)
+                }, passo)
+
+            yield evento_sse("fim", {"session_id": session_id})
+        finally:
+            db.close()
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
+@app.get("/labirintos/{labirinto_id}/ao-vivo")
+async def feed_ao_vivo(request: Request, labirinto_id: int, desde: Optional[int] = None):
+    # Reconnecting EventSource clients resume from the last id they saw
+    ultimo_visto = request.headers.get("last-event-id")
+    if ultimo_visto and ultimo_visto.isdigit():
+        desde = int(ultimo_visto)
+
+    async def eventos():
+        # Subscribe before catching up so no move falls between the log read and the live queue
+        fila = live_feed.assinar(labirinto_id)
+        try:
+            ultimo_id = desde or 0
+            if desde is not None:
+                db = next(get_db())
+                try:
+                    while True:
+                        logs = db.query(MovementLog, SessaoWebSocket.grupo_id)\
+                            .outerjoin(SessaoWebSocket, SessaoWebSocket.id == MovementLog.session_id)\
+                            .filter(MovementLog.labirinto_id == labirinto_id, MovementLog.id > ultimo_id)\
+                            .order_by(MovementLog.id)\
+                            .limit(SSE_CHUNK)\
+                            .all()
+                        if not logs:
+                            break
+                        for log, grupo_id in logs:
+                            yield evento_sse("move", movimento_dto(log, grupo_id), log.id)
+                        ultimo_id = logs[-1][0].id
+                finally:
+                    db.close()
+
+            while True:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if evento is None:
+                    # Server shutting down: reconnect after a jittered delay
+                    yield f"retry: {int(desligamento.atraso_reconexao() * 1000)}\n\n"
+                    break
+                if evento["id"] <= ultimo_id:
+                    continue
+                ultimo_id = evento["id"]
+                yield evento_sse("move", evento, evento["id"])
+        finally:
+            live_feed.cancelar(labirinto_id, fila)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
+async def redirecionar_conexao(websocket: WebSocket, worker: int):
+    # 4307 is this API's "wrong worker" close code; the text carries the owner's URL
+    url = f"{roteador.url(worker)}{websocket.url.path}"
+    if websocket.url.query:
+        url += f"?{websocket.url.query}"
+    await websocket.accept()
+    await websocket.send_text(f"Redirecionar: {url}")
+    await websocket.close(code=4307, reason="Outro worker")
+
+async def recusar_conexao(websocket: WebSocket, motivo: str):
+    # 1013 (Try Again Later) tells clients the refusal is temporary
+    await websocket.accept()
+    await websocket.send_text(motivo)
+    await websocket.close(code=1013, reason="Limite excedido")
+
+async def recusar_por_desligamento(websocket: WebSocket):
+    # 1012 (Service Restart) plus "Reconectar: <segundos>", as sent to sessions being drained
+    await websocket.accept()
+    await desligamento.avisar(websocket)
+
+def finalizar_sessao(grupo_id: UUID, labirinto_id: int, historico: list, passos: int,
+                     vistos: set = frozenset(), consultas_visao: int = 0):
+    # Steps add up across sessions, exploration and completion keep the best session
+    grafo = grafos.obter(labirinto_id)
+    if not (passos or consultas_visao) or not grafo or not grafo.num_vertices:
+        return
+    visitados = {vertice for vertice in historico if grafo.contem(vertice)}
+    # Vertices only seen through "ver:<k>" count as explored when the server says so
+    explorados = visitados | vistos if VISAO_CONTA_EXPLORACAO else visitados
+    progresso.registrar(
+        grupo_id,
+        labirinto_id,
+        passos=passos,
+        exploracao=len(explorados) / grafo.num_vertices,
+        concluido=any(grafo.tipo(vertice) == 2 for vertice in visitados),
+        consultas_visao=consultas_visao
+    )
+
+def snapshot_placar(db) -> list:
+    # Same source as the diffs, so a snapshot never disagrees with the pushes that follow it
+    linhas = db.query(
+        InfoGrupo.grupo_id, Grupo.nome, InfoGrupo.labirinto_id,
+        InfoGrupo.passos, InfoGrupo.exploracao, InfoGrupo.concluido
+    ).join(Grupo, Grupo.id == InfoGrupo.grupo_id)
+    return [
+        {
+            "grupo_id": str(grupo_id),
+            "grupo": nome,
+            "labirinto": labirinto_id,
+            "passos": passos,
+            "exploracao": exploracao,
+            "concluido": bool(concluido)
+        }
+        for grupo_id, nome, labirinto_id, passos, exploracao, concluido in linhas
+    ]
+
+@app.websocket("/ws/placar")
+async def placar_websocket(websocket: WebSocket):
+    if desligamento.encerrando:
+        await recusar_por_desligamento(websocket)
+        return
+    await websocket.accept()
+    # Subscribe first so no diff is lost between the snapshot and the first push
+    placar_hub.assinar(websocket)
+    try:
+        db = next(get_db())
+        try:
+            placar = snapshot_placar(db)
+        finally:
+            db.close()
+        await websocket.send_text(orjson.dumps({"tipo": "snapshot", "placar": placar}).decode())
+        while True:
+            # Clients only listen; reading detects the disconnect
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        placar_hub.cancelar(websocket)
 
 @app.websocket("/ws/{grupo_id}/{labirinto_id}")
 async def websocket_endpoint(
@@ -338,141 +3157,214 @@ async def websocket_endpoint(
     session_id: Optional[int] = None,
     observer: bool = False
 ):
-    db = next(get_db())
-
-    # Create or get session
-    if not session_id:
-        ws_session = SessaoWebSocket(grupo_id=grupo_id, conexao=str(websocket.url))
-        db.add(ws_session)
-        db.commit()
-        db.refresh(ws_session)
-        session_id = ws_session.id
-    else:
-        ws_session = db.query(SessaoWebSocket).filter_by(id=session_id).first()
-        if not ws_session:
-            await websocket.close(code=4000, reason="Invalid session")
+    if desligamento.encerrando:
+        await recusar_por_desligamento(websocket)
+        return
+
+    # Sessions of a maze are only served by its owner, which holds the graph and the observers
+    if not roteador.local(labirinto_id, session_id):
+        await redirecionar_conexao(websocket, roteador.dono(labirinto_id, session_id))
+        return
+
+    # Admission happens before any database work so rejected clients cost nothing
+    motivo = await admissao.admitir_conexao()
+    if motivo:
+        await recusar_conexao(websocket, motivo)
+        return
+    if not observer:
+        motivo = admissao.reservar_sessao(grupo_id, labirinto_id)
+        if motivo:
+            admissao.liberar_conexao()
+            await recusar_conexao(websocket, motivo)
             return
 
-    # Connect to session
-    await manager.connect(websocket, session_id)
+    db = None
+    sessao_aberta = False
+    step_count = 0
+    passos_anteriores = 0
+    historico = []
+    vistos = set()
+    consultas_visao = 0
+    conectado_em = agora_ms()  # Time of the entrance vertex when the history is created
 
     # if observer:
     #     await manager.broadcast_to_session(f"New observer joined session {session_id}", session_id)
     # else:
     #     await manager.broadcast_to_session(f"Player joined session {session_id}", session_id)
 
+    # Everything after admission runs inside this block, so the slots are returned whatever fails
     try:
-        # Load maze and initial position
-        labirinto = db.query(Labirinto).filter(Labirinto.id == labirinto_id).first()
-        if not labirinto:
+        db = next(get_db())
+
+        # Create or get session
+        if not session_id:
+            agora = datetime.datetime.now().isoformat()
+            ws_session = SessaoWebSocket(
+                grupo_id=grupo_id,
+                conexao=str(websocket.url),
+                estado="ativa",
+                criada_em=agora,
+                atualizada_em=agora
+            )
+            db.add(ws_session)
+            db.commit()
+            db.refresh(ws_session)
+            session_id = ws_session.id
+        else:
+            ws_session = db.query(SessaoWebSocket).filter_by(id=session_id).first()
+            # Expired sessions are about to be compacted and cannot be resumed
+            if not ws_session or ws_session.estado == "expirada":
+                await websocket.close(code=4000, reason="Invalid session")
+                return
+            if ws_session.estado != "ativa":
+                marcar_sessao(db, session_id, "ativa")
+        sessao_aberta = True
+
+        # Connect to session
+        await manager.connect(websocket, session_id, labirinto_id)
+        timer_wheel.registrar(websocket, IDLE_TIMEOUT_OBSERVADOR if observer else IDLE_TIMEOUT_JOGADOR)
+
+        # Load maze graph and initial position; revalidated in case another worker edited it
+        grafo = grafos.obter(labirinto_id, revalidar=True)
+        if not grafo:
             await manager.broadcast_to_session("Labirinto não encontrado.", session_id)
             return
 
-        vertice_atual = db.query(Vertice).filter(
-            Vertice.labirinto_id == labirinto_id,
-            Vertice.id == labirinto.entrada
-        ).first()
-
-        if not vertice_atual:
+        vertice_atual = grafo.entrada
+        if not grafo.contem(vertice_atual):
             await manager.broadcast_to_session("Vértice de entrada não encontrado.", session_id)
             return
 
         # Get movement history if exists
         history_record = db.query(MovementHistory).filter_by(session_id=session_id).first()
-        historico = [0]  # Start with initial vertex
+        historico = [vertice_atual]  # Start at the entrance vertex
         if history_record:
-            historico = [int(x) for x in history_record.vertex_sequence.split(',') if x]
+            historico = decodificar_historico(db, history_record)
+        elif not observer:
+            heatmap.registrar(labirinto_id, grupo_id, vertice_atual)
 
         # Send initial vertex information
-        arestas = db.query(Aresta).filter(Aresta.vertice_origem_id == vertice_atual.id).all()
-        adjacentes = [(a.vertice_destino_id, a.peso) for a in arestas]
         await manager.broadcast_to_session(
-            f"Vértice atual: {vertice_atual.id}, Tipo: {vertice_atual.tipo}, Adjacentes(Vertice, Peso): {adjacentes}",
+            f"Vértice atual: {vertice_atual}, Tipo: {grafo.tipo(vertice_atual)}, "
+            f"Adjacentes(Vertice, Peso): {grafo.adjacentes(vertice_atual)}",
             session_id
         )
 
         step_count = len(historico)
+        passos_anteriores = step_count
 
-        # Main game loop
+        # Main game loop; idle connections are closed by the reaper, which ends receive_text
         while True:
+            data = await websocket.receive_text()
+            timer_wheel.tocar(websocket)
+
             if observer:
+                if data == "historico":
+                    await manager.broadcast_to_session(str(historico), session_id)
+                elif data == "labirinto":
+                    await manager.broadcast_to_session(f"Labirinto atual: {labirinto_id}", session_id)
+                continue
+
+            # A PATCH to the maze replaces the cached graph; moves use the newest version
+            grafo = grafos.obter(labirinto_id) or grafo
+
+            if data.startswith("ir:"):
+                espera = admissao.consumir_movimento(session_id, grupo_id)
+                if espera:
+                    await websocket.send_text(f"Limite de movimentos excedido, tente novamente em {espera:.2f}s.")
+                    continue
+
+                vertice_desejado_id = int(data.split(":")[1].strip())
+                adjacentes = [destino for destino, _ in grafo.adjacentes(vertice_atual)]
+
+                if vertice_desejado_id not in adjacentes:
+                    await manager.broadcast_to_session("Movimento inválido", session_id)
+                    continue
+
+                heatmap.registrar(labirinto_id, grupo_id, vertice_desejado_id, origem=vertice_atual)
+                vertice_atual = vertice_desejado_id
+                historico.append(vertice_atual)
+                step_count += 1
+
+                # Append the move to the history's last chunk
+                instante = agora_ms()
+                if history_record:
+                    anexar_movimentos(db, history_record, [vertice_atual], [instante])
+                else:
+                    history_record = MovementHistory(
+                        session_id=session_id,
+                        labirinto_id=labirinto_id,
+                        grupo_id=grupo_id,
+                        move_count=0,
+                        timestamp=datetime.datetime.now().isoformat()
+                    )
+                    db.add(history_record)
+                    anexar_movimentos(
+                        db, history_record, historico, [conectado_em] + [instante] * (len(historico) - 1)
+                    )
+                log = MovementLog(
+                    session_id=session_id,
+                    labirinto_id=labirinto_id,
+                    passo=len(historico) - 1,
+                    vertice_id=vertice_atual,
+                    instante=instante
+                )
+                db.add(log)
+                db.commit()
+                live_feed.publicar(labirinto_id, movimento_dto(log, grupo_id))
+
+                # Send updated vertex information
+                await manager.broadcast_to_session(
+                    f"Vértice atual: {vertice_atual}, Tipo: {grafo.tipo(vertice_atual)}, "
+                    f"Adjacentes(Vertice, Peso): {grafo.adjacentes(vertice_atual)}",
+                    session_id
+                )
+
+            elif data == "ver" or data.startswith("ver:"):
+                if not RAIO_VISAO_MAX:
+                    await websocket.send_text("Comando ver desativado.")
+                    continue
                 try:
-                    data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                    if data == "historico":
-                        await manager.broadcast_to_session(str(historico), session_id)
-                    elif data == "labirinto":
-                        await manager.broadcast_to_session(f"Labirinto atual: {labirinto_id}", session_id)
-                except:
-                    break
-            else:
-                try:
-                    data = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-
-                    if data.startswith("ir:"):
-                        vertice_desejado_id = int(data.split(":")[1].strip())
-                        adjacentes = [a[0] for a in db.query(Aresta.vertice_destino_id)
-                                    .filter(Aresta.vertice_origem_id == vertice_atual.id).all()]
-
-                        if vertice_desejado_id not in adjacentes:
-                            await manager.broadcast_to_session("Movimento inválido", session_id)
-                            continue
-
-                        vertice_atual = db.query(Vertice).filter(
-                            Vertice.labirinto_id == labirinto_id,
-                            Vertice.id == vertice_desejado_id
-                        ).first()
-
-                        historico.append(vertice_atual.id)
-                        step_count += 1
-
-                        # Update history in database
-                        history_record = db.query(MovementHistory).filter_by(session_id=session_id).first()
-                        if history_record:
-                            history_record.vertex_sequence = ','.join(map(str, historico))
-                        else:
-                            history_record = MovementHistory(
-                                session_id=session_id,
-                                labirinto_id=labirinto_id,
-                                grupo_id=grupo_id,
-                                vertex_sequence=','.join(map(str, historico)),
-                                timestamp=datetime.datetime.now().isoformat()
-                            )
-                            db.add(history_record)
-                        db.commit()
-
-                        # Get updated adjacent vertices
-                        arestas = db.query(Aresta).filter(Aresta.vertice_origem_id == vertice_atual.id).all()
-                        adjacentes = [(a.vertice_destino_id, a.peso) for a in arestas]
-
-                        # Send updated vertex information
-                        await manager.broadcast_to_session(
-                            f"Vértice atual: {vertice_atual.id}, Tipo: {vertice_atual.tipo}, Adjacentes(Vertice, Peso): {adjacentes}",
-                            session_id
-                        )
-
-                    elif data == "historico":
-                        await manager.broadcast_to_session(str(historico), session_id)
-                    elif data == "labirinto":
-                        await manager.broadcast_to_session(f"Labirinto atual: {labirinto_id}", session_id)
+                    raio = int(data.split(":")[1]) if ":" in data else RAIO_VISAO_MAX
+                except ValueError:
+                    await websocket.send_text("Raio inválido")
+                    continue
+                raio = max(1, min(raio, RAIO_VISAO_MAX))
+                # A view costs one move token, so it cannot be used to flood the server
+                espera = admissao.consumir_movimento(session_id, grupo_id)
+                if espera:
+                    await websocket.send_text(f"Limite de movimentos excedido, tente novamente em {espera:.2f}s.")
+                    continue
 
-                except asyncio.TimeoutError:
-                    await manager.broadcast_to_session("Conexão encerrada por inatividade.", session_id)
-                    break
+                visao = vizinhanca(grafo, vertice_atual, raio, VISAO_MAX_VERTICES, set(historico))
+                consultas_visao += 1
+                vistos.update(vertice for vertice, _, _, _ in visao["vertices"])
+                await websocket.send_text("Visão: " + orjson.dumps(visao).decode())
+
+            elif data == "historico":
+                await manager.broadcast_to_session(str(historico), session_id)
+            elif data == "labirinto":
+                await manager.broadcast_to_session(f"Labirinto atual: {labirinto_id}", session_id)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, session_id)
-        grupo_info = db.query(InfoGrupo).filter(
-            InfoGrupo.grupo_id == str(grupo_id),
-            InfoGrupo.labirinto_id == labirinto_id
-        ).first()
-
-        if grupo_info:
-            grupo_info.passos = step_count
-            grupo_info.exploracao = step_count / len(
-                db.query(Vertice).filter(Vertice.labirinto_id == labirinto_id).all()
-            )
-            db.add(grupo_info)
-            db.commit()
+        pass
+    finally:
+        # Normal disconnects, idle expiry, early exits and errors all go through the same cleanup
+        try:
+            timer_wheel.remover(websocket)
+            manager.disconnect(websocket, session_id, labirinto_id)
+            finalizar_sessao(grupo_id, labirinto_id, historico, step_count - passos_anteriores, vistos, consultas_visao)
+            # Observers share the session; it is disconnected when its last connection leaves
+            if sessao_aberta and session_id not in manager.session_connections:
+                # A failed commit leaves the session unusable until it is rolled back
+                db.rollback()
+                marcar_sessao(db, session_id, "desconectada")
+        finally:
+            if db is not None:
+                db.close()
+            admissao.liberar_conexao()
+            if not observer:
+                admissao.liberar_sessao(grupo_id, labirinto_id, session_id)
 
         # if observer:
         #     await manager.broadcast_to_session(f"Observer left session {session_id}", session_id)
@@ -480,115 +3372,394 @@ async def websocket_endpoint(
         #     await manager.broadcast_to_session(f"Player left session {session_id}", session_id)
 
 @app.get("/labirintos/{labirinto_id}/arestas", response_model=List[dict])
-def get_arestas(labirinto_id: int):
-    db = next(get_db())
-    try:
-        # First check if the maze exists
-        labirinto = db.query(Labirinto).filter(Labirinto.id == labirinto_id).first()
-        if not labirinto:
+def get_arestas(request: Request, labirinto_id: int):
+    def gerar():
+        db = next(get_db())
+        try:
+            # First check if the maze exists
+            labirinto = db.query(Labirinto).filter(Labirinto.id == labirinto_id).first()
+            if not labirinto:
+                raise HTTPException(status_code=404, detail="Labirinto não encontrado.")
+
+            # Get all edges for this maze
+            arestas = db.query(Aresta).filter(Aresta.labirinto_id == labirinto_id).all()
+
+            if not arestas:
+                raise HTTPException(status_code=404, detail="Labirinto não possui arestas.")
+
+            return [
+                {
+                    "origem": aresta.vertice_origem_id,
+                    "destino": aresta.vertice_destino_id,
+                    "peso": aresta.peso
+                }
+                for aresta in arestas
+            ]
+        finally:
+            db.close()
+
+    return resposta_em_cache(request, [("labirinto", labirinto_id)], gerar)
+
+@app.get("/labirintos/{labirinto_id}/analise")
+def get_analise(request: Request, labirinto_id: int):
+    def gerar():
+        grafo = grafos.obter(labirinto_id)
+        if not grafo:
             raise HTTPException(status_code=404, detail="Labirinto não encontrado.")
+        return analisar_grafo(grafo)
 
-        # Get all edges for this maze
-        arestas = db.query(Aresta).filter(Aresta.labirinto_id == labirinto_id).all()
+    # Cached per maze version, like the edge list
+    return resposta_em_cache(request, [("labirinto", labirinto_id)], gerar)
 
-        if not arestas:
-            raise HTTPException(status_code=404, detail="Labirinto não possui arestas.")
+@app.get("/labirintos/{labirinto_id}/heatmap")
+def get_heatmap(
+    request: Request,
+    labirinto_id: int,
+    grupo_id: Optional[UUID] = None,
+    desde: Optional[datetime.datetime] = None,
+    ate: Optional[datetime.datetime] = None,
+    top: int = 10
+):
+    top = max(1, min(top, HEATMAP_TOP_MAX))
 
-        return [
-            {
-                "origem": aresta.vertice_origem_id,
-                "destino": aresta.vertice_destino_id,
-                "peso": aresta.peso
-            }
-            for aresta in arestas
-        ]
+    def gerar():
+        if not entidades.labirinto(labirinto_id):
+            raise HTTPException(status_code=404, detail="Labirinto não encontrado.")
+
+        # Served from the hourly counters; the window is widened to whole hours
+        def filtrar(consulta, modelo):
+            consulta = consulta.filter(modelo.labirinto_id == labirinto_id)
+            if grupo_id:
+                consulta = consulta.filter(modelo.grupo_id == grupo_id)
+            if desde:
+                consulta = consulta.filter(modelo.periodo >= desde.isoformat(timespec="hours"))
+            if ate:
+                consulta = consulta.filter(modelo.periodo <= ate.isoformat(timespec="hours"))
+            return consulta
+
+        db = next(get_db())
+        try:
+            visitas = func.sum(HeatmapVertice.visitas)
+            vertices = filtrar(db.query(HeatmapVertice.vertice_id, visitas), HeatmapVertice)\
+                .group_by(HeatmapVertice.vertice_id)\
+                .order_by(HeatmapVertice.vertice_id)\
+                .all()
+            transicoes = func.sum(HeatmapAresta.transicoes)
+            arestas = filtrar(db.query(HeatmapAresta.origem_id, HeatmapAresta.destino_id, transicoes), HeatmapAresta)\
+                .group_by(HeatmapAresta.origem_id, HeatmapAresta.destino_id)\
+                .order_by(HeatmapAresta.origem_id, HeatmapAresta.destino_id)\
+                .all()
+        finally:
+            db.close()
+
+        return {
+            "labirinto": labirinto_id,
+            "total_visitas": sum(quantidade for _, quantidade in vertices),
+            "vertices": [{"vertice": vertice, "visitas": quantidade} for vertice, quantidade in vertices],
+            "arestas": [
+                {"origem": origem, "destino": destino, "transicoes": quantidade}
+                for origem, destino, quantidade in arestas
+            ],
+            "top_vertices": [
+                {"vertice": vertice, "visitas": quantidade}
+                for vertice, quantidade in heapq.nlargest(top, vertices, key=lambda linha: linha[1])
+            ],
+            "top_arestas": [
+                {"origem": origem, "destino": destino, "transicoes": quantidade}
+                for origem, destino, quantidade in heapq.nlargest(top, arestas, key=lambda linha: linha[2])
+            ]
+        }
+
+    # Invalidated whenever HeatmapBuffer flushes counts for this maze
+    return resposta_em_cache(request, [("heatmap", labirinto_id)], gerar)
+
+def obter_labirinto_edicao(db, labirinto_id: int) -> Labirinto:
+    labirinto = db.query(Labirinto).filter(Labirinto.id == labirinto_id).first()
+    if not labirinto:
+        raise HTTPException(status_code=404, detail="Labirinto não encontrado.")
+    return labirinto
+
+def trava_edicao(labirinto_id: int) -> asyncio.Lock:
+    # Edits of one maze are serialized, so each one is applied on top of the previous snapshot.
+    # The lock is taken before any SQL: a write transaction left open across an await would
+    # block every other writer of the SQLite file until the busy timeout
+    if not entidades.labirinto(labirinto_id):
+        raise HTTPException(status_code=404, detail="Labirinto não encontrado.")
+    return travas_edicao.setdefault(labirinto_id, asyncio.Lock())
+
+def grafo_edicao(labirinto_id: int):
+    # Loaded before the edit's DML, since a missing snapshot is exported through another connection
+    return None if roteador.ativo else grafos.obter(labirinto_id, revalidar=True)
+
+async def publicar_edicao(db, labirinto: Labirinto, grafo, tipos: Optional[dict] = None, removidos: Optional[set] = None,
+                          arestas_removidas: Optional[set] = None, arestas: Optional[dict] = None) -> int:
+    # Commits the edit under a new version and refreshes only this maze's derived state.
+    # Callers hold trava_edicao(labirinto.id); the commit comes before the first await
+    labirinto.versao = (labirinto.versao or 1) + 1
+    db.commit()
+    versao = labirinto.versao
+    # The CSR snapshot is immutable, so the edited copy is written off the event loop and
+    # swapped in atomically; applying the delta again to a freshly exported graph is harmless.
+    # Workers of a cluster may edit the same maze at once, so there the database stays the source
+    if roteador.ativo:
+        await asyncio.to_thread(reexportar_snapshot, labirinto.id)
+    else:
+        await asyncio.to_thread(
+            editar_snapshot, grafo, caminho_snapshot(labirinto.id), tipos or {}, removidos or set(),
+            arestas_removidas or set(), arestas or {}
+        )
+    grafos.descartar(labirinto.id)
+    entidades.descartar("labirinto", labirinto.id)
+    response_cache.invalidar(("labirinto", labirinto.id))
+    await manager.broadcast_to_labirinto(f"Labirinto atualizado: versão {versao}", labirinto.id)
+    return versao
+
+@app.patch("/labirintos/{labirinto_id}/vertices")
+async def editar_vertices(labirinto_id: int, edicao: EdicaoVerticesDto):
+    async with trava_edicao(labirinto_id):
+        db = next(get_db())
+        try:
+            labirinto = obter_labirinto_edicao(db, labirinto_id)
+            grafo = grafo_edicao(labirinto_id)
+            removidos = set(edicao.remover)
+            if labirinto.entrada in removidos:
+                raise HTTPException(status_code=400, detail="O vértice de entrada não pode ser removido.")
+            if removidos & {vertice.id for vertice in edicao.adicionar}:
+                raise HTTPException(status_code=400, detail="Um vértice não pode ser adicionado e removido na mesma edição.")
+
+            if removidos:
+                db.query(Aresta).filter(
+                    Aresta.labirinto_id == labirinto_id,
+                    (Aresta.vertice_origem_id.in_(removidos)) | (Aresta.vertice_destino_id.in_(removidos))
+                ).delete(synchronize_session=False)
+                db.query(Vertice).filter(
+                    Vertice.labirinto_id == labirinto_id,
+                    Vertice.id.in_(removidos)
+                ).delete(synchronize_session=False)
+            if edicao.adicionar:
+                comando = sqlite_insert(Vertice)
+                db.execute(
+                    comando.on_conflict_do_update(
+                        index_elements=[Vertice.id, Vertice.labirinto_id],
+                        set_={"tipo": comando.excluded.tipo}
+                    ),
+                    [{"id": v.id, "labirinto_id": labirinto_id, "tipo": v.tipo} for v in edicao.adicionar]
+                )
+
+            # Exits are denormalized into Labirinto.saida in the format criar_labirinto writes
+            saidas = db.query(Vertice.id)\
+                .filter(Vertice.labirinto_id == labirinto_id, Vertice.tipo == 2)\
+                .order_by(Vertice.id)
+            labirinto.saida = "".join(f"{vertice_id}, " for vertice_id, in saidas) or None
+            versao = await publicar_edicao(
+                db, labirinto, grafo, tipos={v.id: v.tipo for v in edicao.adicionar}, removidos=removidos
+            )
+            return {"LabirintoId": labirinto_id, "versao": versao}
+        finally:
+            db.close()
+
+@app.patch("/labirintos/{labirinto_id}/arestas")
+async def editar_arestas(labirinto_id: int, edicao: EdicaoArestasDto):
+    async with trava_edicao(labirinto_id):
+        db = next(get_db())
+        try:
+            labirinto = obter_labirinto_edicao(db, labirinto_id)
+            grafo = grafo_edicao(labirinto_id)
+            if edicao.adicionar:
+                extremos = {a.origemId for a in edicao.adicionar} | {a.destinoId for a in edicao.adicionar}
+                existentes = {
+                    vertice_id for vertice_id, in db.query(Vertice.id).filter(
+                        Vertice.labirinto_id == labirinto_id, Vertice.id.in_(extremos)
+                    )
+                }
+                faltantes = sorted(extremos - existentes)
+                if faltantes:
+                    raise HTTPException(status_code=400, detail=f"Vértices inexistentes: {faltantes[:20]}")
+
+            if edicao.remover:
+                db.query(Aresta).filter(
+                    Aresta.labirinto_id == labirinto_id,
+                    tuple_(Aresta.vertice_origem_id, Aresta.vertice_destino_id).in_(
+                        [(a.origemId, a.destinoId) for a in edicao.remover]
+                    )
+                ).delete(synchronize_session=False)
+            if edicao.adicionar:
+                comando = sqlite_insert(Aresta)
+                db.execute(
+                    comando.on_conflict_do_update(
+                        index_elements=[Aresta.vertice_origem_id, Aresta.vertice_destino_id, Aresta.labirinto_id],
+                        set_={"peso": comando.excluded.peso}
+                    ),
+                    [
+                        {"vertice_origem_id": a.origemId, "vertice_destino_id": a.destinoId,
+                         "peso": a.peso, "labirinto_id": labirinto_id}
+                        for a in edicao.adicionar
+                    ]
+                )
+
+            versao = await publicar_edicao(
+                db, labirinto, grafo,
+                arestas_removidas={(a.origemId, a.destinoId) for a in edicao.remover},
+                arestas={(a.origemId, a.destinoId): a.peso for a in edicao.adicionar}
+            )
+            return {"LabirintoId": labirinto_id, "versao": versao}
+        finally:
+            db.close()
+
+@app.post("/jobs", status_code=202)
+async def criar_job(job: JobDto):
+    if job.tipo not in JOBS:
+        raise HTTPException(status_code=400, detail=f"Tipo de job inválido. Use um de: {', '.join(JOBS)}")
+    return {"job_id": jobs.submeter(job.tipo, job.parametros)}
+
+@app.post("/admin/recorrigir", status_code=202)
+async def recorrigir(labirinto_id: Optional[int] = None, lote: int = 1000):
+    if labirinto_id is not None and not entidades.labirinto(labirinto_id):
+        raise HTTPException(status_code=404, detail="Labirinto não encontrado")
+    parametros = {"lote": max(1, min(lote, 10000))}
+    if labirinto_id is not None:
+        parametros["labirinto_id"] = labirinto_id
+    return {"job_id": jobs.submeter("recorrigir", parametros)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    db = next(get_db())
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job não encontrado")
+        return FastJSONResponse({
+            "id": job.id,
+            "tipo": job.tipo,
+            "estado": job.estado,
+            "progresso": job.progresso,
+            "resultado": json.loads(job.resultado) if job.resultado else None,
+            "erro": job.erro,
+            "criado_em": job.criado_em,
+            "atualizado_em": job.atualizado_em
+        })
     finally:
         db.close()
 
 @app.post("/generate-websocket/")
 async def generate_websocket_link(connection: WebsocketRequestDto):
-    db = next(get_db())
-    grupo = db.query(Grupo).filter(Grupo.id == connection.grupo_id).first()
-    labirinto = db.query(Labirinto).filter(Labirinto.id == connection.labirinto_id).first()
-
-    if not grupo:
+    if desligamento.encerrando:
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor reiniciando",
+            headers={"Retry-After": str(math.ceil(desligamento.atraso_reconexao()))}
+        )
+    if not entidades.grupo(connection.grupo_id):
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
-    if not labirinto:
+    if not entidades.labirinto(connection.labirinto_id):
         raise HTTPException(status_code=404, detail="Labirinto não encontrado")
 
-    ws_url = f"ws://localhost:8000/ws/{connection.grupo_id}/{connection.labirinto_id}"
-
-    sessao_ws = SessaoWebSocket(grupo_id=connection.grupo_id, conexao=ws_url)
-    db.add(sessao_ws)
-    db.commit()
-
-    return {"websocket_url": ws_url, "session_id": sessao_ws.id}
-
-@app.get("/placar/{grupo_id}")
-async def get_placar_por_grupo(grupo_id: UUID):
     db = next(get_db())
-    grupo = db.query(Grupo).filter(Grupo.id == grupo_id).first()
-
-    if not grupo:
-        raise HTTPException(status_code=404, detail="Grupo não encontrado")
-
-    dados = db.query(InfoGrupo).filter(InfoGrupo.grupo_id == grupo_id).all()
+    try:
+        agora = datetime.datetime.now().isoformat()
+        sessao_ws = SessaoWebSocket(grupo_id=connection.grupo_id, estado="criada", criada_em=agora, atualizada_em=agora)
+        db.add(sessao_ws)
+        db.flush()
+        # The URL points at the worker that owns the maze (or the session) in a cluster and
+        # carries the session id, so connecting reuses this row instead of inserting another
+        worker = roteador.dono(connection.labirinto_id, sessao_ws.id)
+        ws_url = f"{roteador.url(worker)}/ws/{connection.grupo_id}/{connection.labirinto_id}?session_id={sessao_ws.id}"
+        sessao_ws.conexao = ws_url
+        db.commit()
+        return {"websocket_url": ws_url, "session_id": sessao_ws.id, "worker": worker}
+    finally:
+        db.close()
 
-    placar = {
-        "grupo": grupo.nome,
-        "labirintos": [
-            {
-                "labirinto": dado.labirinto_id,
-                "passos": dado.passos,
-                "exploracao": dado.exploracao
+@app.get("/placar/{grupo_id}")
+async def get_placar_por_grupo(request: Request, grupo_id: UUID):
+    def gerar():
+        grupo = entidades.grupo(grupo_id)
+        if not grupo:
+            raise HTTPException(status_code=404, detail="Grupo não encontrado")
+
+        db = next(get_db())
+        try:
+            dados = db.query(InfoGrupo).filter(InfoGrupo.grupo_id == grupo_id).all()
+
+            placar = {
+                "grupo": grupo.nome,
+                "labirintos": [
+                    {
+                        "labirinto": dado.labirinto_id,
+                        "passos": dado.passos,
+                        "exploracao": dado.exploracao,
+                        "concluido": bool(dado.concluido),
+                        "consultas_visao": dado.consultas_visao or 0
+                    }
+                    for dado in dados
+                ]
             }
-            for dado in dados
-        ]
-    }
 
-    return placar
+            return placar
+        finally:
+            db.close()
+
+    return resposta_em_cache(request, [("placar", grupo_id)], gerar)
 
 @app.post("/resposta")
 async def enviar_resposta(resposta: RespostaDto):
-    db = next(get_db())
-    grupo = db.query(Grupo).filter(Grupo.id == resposta.grupo).first()
+    grupo = entidades.grupo(resposta.grupo)
     if not grupo:
         raise HTTPException(status_code=404, detail="Grupo não encontrado")
 
-    labirinto = db.query(Labirinto).filter(Labirinto.id == resposta.labirinto).first()
-    if not labirinto:
+    labirinto = entidades.labirinto(resposta.labirinto)
+    grafo = grafos.obter(resposta.labirinto)
+    if not labirinto or not grafo:
         raise HTTPException(status_code=404, detail="Labirinto não encontrado")
 
     vertices = resposta.vertices
-    saida = [int(s) for s in labirinto.saida.split(",") if s.strip()]
-
-    if vertices[0] != labirinto.entrada or vertices[-1] not in saida:
+    if not vertices or vertices[0] != labirinto.entrada or vertices[-1] not in labirinto.saidas:
         raise HTTPException(status_code=400, detail="Labirinto não foi concluído")
 
-    # Check if each consecutive pair in vertices list has an edge connecting them
-    for i in range(len(vertices) - 1):
-        vertice_atual_id = vertices[i]
-        vertice_proximo_id = vertices[i + 1]
-
-        aresta = db.query(Aresta).filter(
-            Aresta.vertice_origem_id == vertice_atual_id,
-            Aresta.vertice_destino_id == vertice_proximo_id,
-            Aresta.labirinto_id == labirinto.id
-        ).first()
-
-        if not aresta:
+    # Check each consecutive pair against the cached graph instead of one query per hop
+    for vertice_atual_id, vertice_proximo_id in zip(vertices, vertices[1:]):
+        if not grafo.contem(vertice_atual_id) or \
+                all(destino != vertice_proximo_id for destino, _ in grafo.adjacentes(vertice_atual_id)):
             raise HTTPException(status_code=400, detail="Caminho inválido")
 
-    grupo.labirintos_concluidos = (
-        grupo.labirintos_concluidos + f",{labirinto.id}"
-        if grupo.labirintos_concluidos
-        else str(labirinto.id)
-    )
-    db.add(grupo)
-    db.commit()
+    # Appended in SQL so concurrent answers from the same group don't overwrite each other
+    db = next(get_db())
+    try:
+        db.query(Grupo).filter(Grupo.id == grupo.id).update({
+            Grupo.labirintos_concluidos: case(
+                (func.coalesce(Grupo.labirintos_concluidos, "") == "", str(labirinto.id)),
+                else_=Grupo.labirintos_concluidos + f",{labirinto.id}"
+            )
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    progresso.registrar(grupo.id, labirinto.id, concluido=True)
+    response_cache.invalidar("grupos")
+    placar_hub.publicar(grupo.id, labirinto.id, concluido=True)
 
     return {"message": "Labirinto concluído com sucesso"}
 
-if __name__ == "__main__":
+def servir(host: str, porta: int):
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    class ServidorGracioso(uvicorn.Server):
+        async def shutdown(self, sockets=None):
+            # Drain first: uvicorn's own shutdown drops websockets with 1012 and no reconnect hint
+            await desligamento.drenar()
+            await super().shutdown(sockets)
+
+    config = uvicorn.Config(app, host=host, port=porta, timeout_graceful_shutdown=DESLIGAMENTO_PRAZO)
+    ServidorGracioso(config).run()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="API do labirinto.")
+    parser.add_argument("comando", nargs="?", choices=["migrar"], help="só migra o esquema e sai")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=8000)
+    args = parser.parse_args()
+    if args.comando == "migrar":
+        migrar_banco()
+    else:
+        servir(args.host, args.porta)
@@ -0,0 +1,37 @@
+"""Re-grade every stored movement history against the current mazes.
+
+Usage:
+    python regradar.py [--labirinto 3] [--lote 1000]
+
+Each path is checked against its maze's edge set and the results are written
+back to movement_history: valido, chegou_saida, custo and otimo (reached an
+exit at the minimum cost). Rows are read in keyset pages of --lote histories
+and updated in bulk, so memory stays bounded on large events. The same work
+runs on the server through POST /admin/recorrigir.
+"""
+import argparse
+
+import main
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Recorrige os históricos de movimentos armazenados.")
+    parser.add_argument("--labirinto", type=int, help="recorrige apenas este labirinto")
+    parser.add_argument("--lote", type=int, default=1000, help="históricos por página")
+    args = parser.parse_args()
+
+    main.migrar_banco()
+    totais = main.recorrigir_historicos(
+        args.labirinto,
+        args.lote,
+        lambda fracao: print(f"\r{fracao:.0%}", end="", flush=True)
+    )
+    print(
+        f"\r{totais['processados']} históricos em {totais['segundos']}s: "
+        f"{totais['validos']} válidos, {totais['chegaram_saida']} chegaram à saída, "
+        f"{totais['otimos']} ótimos"
+    )
+
+
+if __name__ == "__main__":
+    main_cli()
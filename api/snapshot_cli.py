@@ -0,0 +1,81 @@
+"""Export and import binary maze snapshots.
+
+Usage:
+    python snapshot_cli.py exportar <labirinto_id> [--arquivo labirinto.bin]
+    python snapshot_cli.py exportar --todos [--dir ./snapshots]
+    python snapshot_cli.py importar <arquivo.bin> [<arquivo.bin> ...]
+
+Exported files use the same CSR layout the server maps into memory, so a maze
+can be shipped between environments without replaying its JSON. Importing
+creates a new maze (with a new id) and writes its snapshot to SNAPSHOT_DIR.
+"""
+import argparse
+import os
+
+import main
+
+
+def exportar(args):
+    db = main.SessionLocal()
+    try:
+        if args.todos:
+            labirinto_ids = [lab_id for lab_id, in db.query(main.Labirinto.id)]
+        elif args.labirinto_id is not None:
+            labirinto_ids = [args.labirinto_id]
+        else:
+            raise SystemExit("Informe um labirinto_id ou --todos")
+
+        for labirinto_id in labirinto_ids:
+            if args.arquivo and not args.todos:
+                caminho = args.arquivo
+            else:
+                caminho = os.path.join(args.dir, f"labirinto_{labirinto_id}.bin")
+            if main.exportar_snapshot(db, labirinto_id, caminho) is None:
+                raise SystemExit(f"Labirinto {labirinto_id} não encontrado")
+            print(f"Labirinto {labirinto_id} exportado para {caminho}")
+    finally:
+        db.close()
+
+
+def importar(args):
+    db = main.SessionLocal()
+    try:
+        for arquivo in args.arquivos:
+            snapshot = main.SnapshotLabirinto(arquivo)
+            vertices = list(zip(snapshot.vertices, snapshot.tipos))
+            arestas = [
+                (origem, destino, peso)
+                for origem in snapshot.vertices
+                for destino, peso in snapshot.adjacentes(origem)
+            ]
+            labirinto_id = main.inserir_labirinto(
+                db, snapshot.dificuldade, snapshot.entrada, vertices, arestas
+            )
+            main.exportar_snapshot(db, labirinto_id)
+            print(f"{arquivo} importado como labirinto {labirinto_id}")
+    finally:
+        db.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Exporta e importa snapshots binários de labirintos.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    parser_exportar = comandos.add_parser("exportar")
+    parser_exportar.add_argument("labirinto_id", type=int, nargs="?")
+    parser_exportar.add_argument("--todos", action="store_true")
+    parser_exportar.add_argument("--arquivo")
+    parser_exportar.add_argument("--dir", default=main.SNAPSHOT_DIR)
+    parser_exportar.set_defaults(funcao=exportar)
+
+    parser_importar = comandos.add_parser("importar")
+    parser_importar.add_argument("arquivos", nargs="+")
+    parser_importar.set_defaults(funcao=importar)
+
+    args = parser.parse_args()
+    main.migrar_banco()
+    args.funcao(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,332 @@
+"""Per-endpoint benchmark suite with JSON baselines and a regression gate.
+
+Runs the app in-process through TestClient against a temporary SQLite database
+seeded with synthetic mazes of 10, 500 and 50k vertices, and times:
+- POST /grupo and POST /labirinto
+- POST /resposta over a path of up to CAMINHO_RESPOSTA hops
+- GET /sessoes with SESSOES seeded sessions
+- GET /labirintos/{id}/arestas, with a cold and a warm response cache
+- a websocket session doing MOVIMENTOS_WS moves
+
+Each case runs --aquecimento discarded warm-up rounds, then up to --repeticoes
+timed rounds (at least 3, stopping early once --orcamento seconds are spent on
+the case), and reports the fastest round in milliseconds. The minimum is the
+least noisy estimate of a case's cost: interference only ever adds time.
+
+A fixed pure-Python workload is timed the same way as an in-run reference and
+stored with the baseline. --comparar scales the baseline by the ratio between
+the current and the stored reference, so a uniformly slower or busier machine
+does not read as a regression.
+
+Usage:
+    python benchmarks/bench_endpoints.py                       # print results
+    python benchmarks/bench_endpoints.py --salvar              # write the baseline
+    python benchmarks/bench_endpoints.py --comparar [--limite 0.25]
+    python benchmarks/bench_endpoints.py --tamanhos 10 500     # skip the 50k maze
+
+--comparar exits with status 1 when a case is slower than the scaled baseline by
+more than --limite (a fraction) plus --folga milliseconds in the first run and
+in each of --confirmacoes fresh runs (default 2), and with status 2,
+before measuring anything, when --repeticoes, --aquecimento or --tamanhos differ
+from the values stored in the baseline. Baselines are machine dependent; regenerate them
+with --salvar on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PADRAO = os.path.join(DIRETORIO, "baselines", "endpoints.json")
+AMBIENTE = dict(os.environ)  # Confirmation runs start from it, so each one gets a fresh database
+
+sys.path.insert(0, os.path.join(DIRETORIO, "..", "api"))
+os.chdir(tempfile.mkdtemp())  # Keep the SQLite file and snapshots out of the repo
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.getcwd()}/bench.sqlite3")
+os.environ.setdefault("SNAPSHOT_DIR", os.path.join(os.getcwd(), "snapshots"))
+os.environ.setdefault("WARMUP_LABIRINTOS", "0")
+# The move loop must measure the handler, not the token bucket
+os.environ.setdefault("RAJADA_MOVIMENTOS", "1000000")
+os.environ.setdefault("RAJADA_MOVIMENTOS_GRUPO", "1000000")
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+TAMANHOS = [10, 500, 50000]
+CAMINHO_RESPOSTA = 100
+SESSOES = 200
+MOVIMENTOS_WS = 100
+
+
+def gerar_labirinto(n, seed=0):
+    # Bidirectional chain 0..n-1 plus ~n/2 random shortcuts; exits at the end of the
+    # chain and at CAMINHO_RESPOSTA - 1 so /resposta stays bounded on big mazes
+    rng = random.Random(seed)
+    saidas = {n - 1, min(n, CAMINHO_RESPOSTA) - 1}
+    vertices = [{"id": i, "tipo": 1 if i == 0 else 2 if i in saidas else 0} for i in range(n)]
+    arestas = {}
+    for i in range(n - 1):
+        arestas[(i, i + 1)] = rng.randint(1, 9)
+        arestas[(i + 1, i)] = rng.randint(1, 9)
+    for _ in range(n // 2):
+        origem, destino = rng.randrange(n), rng.randrange(n)
+        if origem != destino:
+            arestas.setdefault((origem, destino), rng.randint(1, 9))
+    return {
+        "dificuldade": f"bench-{n}",
+        "vertices": vertices,
+        "arestas": [{"origemId": o, "destinoId": d, "peso": p} for (o, d), p in arestas.items()]
+    }
+
+
+def semear(labirintos):
+    # Mazes go through inserir_labirinto so seeding 50k vertices stays fast
+    db = main.SessionLocal()
+    try:
+        ids = {}
+        for n, dados in labirintos.items():
+            ids[n] = main.inserir_labirinto(
+                db,
+                dados["dificuldade"],
+                0,
+                [(v["id"], v["tipo"]) for v in dados["vertices"]],
+                [(a["origemId"], a["destinoId"], a["peso"]) for a in dados["arestas"]]
+            )
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def semear_sessoes(client, labirinto_id):
+    grupo_id = client.post("/grupo", json={"nome": "bench-sessoes"}).json()["GrupoId"]
+    db = main.SessionLocal()
+    try:
+        for _ in range(SESSOES):
+            sessao = main.SessaoWebSocket(grupo_id=main.UUID(grupo_id), conexao="bench")
+            db.add(sessao)
+            db.flush()
+            history = main.MovementHistory(
+                session_id=sessao.id,
+                labirinto_id=labirinto_id,
+                grupo_id=main.UUID(grupo_id),
+                move_count=0,
+                timestamp=main.datetime.datetime.now().isoformat()
+            )
+            db.add(history)
+            main.anexar_movimentos(db, history, [0, 1, 0, 1])
+        db.commit()
+    finally:
+        db.close()
+
+
+MIN_REPETICOES = 3
+# Run parameters stored with the baseline; --comparar refuses a run that differs in any of them
+PARAMETROS_BASELINE = ("repeticoes", "aquecimento", "tamanhos")
+
+
+def medir(funcao, repeticoes, aquecimento=2, orcamento=10.0, preparar=None):
+    # Warm-up fills caches, lazy imports and the allocator; slow cases stop at the budget here too
+    limite = time.perf_counter() + orcamento
+    for _ in range(aquecimento):
+        if preparar:
+            preparar()
+        funcao()
+        if time.perf_counter() > limite:
+            break
+    tempos = []
+    limite = time.perf_counter() + orcamento
+    while len(tempos) < repeticoes:
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if len(tempos) >= MIN_REPETICOES and time.perf_counter() > limite:
+            break
+    return min(tempos)
+
+
+def referencia():
+    # CPU-bound work shaped like the handlers (dicts, JSON, sorting), with no I/O
+    dados = [{"id": i, "tipo": i % 3, "vizinhos": [i + 1, i - 1]} for i in range(20000)]
+    json.loads(json.dumps(dados))
+    sorted(dados, key=lambda item: (item["tipo"], -item["id"]))
+
+
+def verificar(resposta, status=200):
+    assert resposta.status_code == status, (resposta.status_code, resposta.text[:200])
+    return resposta
+
+
+def sessao_ws(client, grupo_id, labirinto_id):
+    with client.websocket_connect(f"/ws/{grupo_id}/{labirinto_id}") as websocket:
+        websocket.receive_text()
+        for i in range(MOVIMENTOS_WS):
+            websocket.send_text("ir:1" if i % 2 == 0 else "ir:0")
+            websocket.receive_text()
+
+
+def executar(repeticoes, tamanhos, aquecimento, orcamento):
+    labirintos = {n: gerar_labirinto(n) for n in tamanhos}
+    resultados = {}
+
+    def medir_caso(funcao, preparar=None):
+        return medir(funcao, repeticoes, aquecimento, orcamento, preparar)
+
+    with TestClient(main.app) as client:
+        ids = semear(labirintos)
+        grupo_id = verificar(client.post("/grupo", json={"nome": "bench"})).json()["GrupoId"]
+
+        resultados["POST /grupo"] = medir_caso(
+            lambda: verificar(client.post("/grupo", json={"nome": "bench-registro"})))
+
+        for n in tamanhos:
+            labirinto_id = ids[n]
+            dados = labirintos[n]
+            caminho = list(range(min(n, CAMINHO_RESPOSTA)))
+
+            resultados[f"POST /labirinto [{n}]"] = medir_caso(
+                lambda: verificar(client.post("/labirinto", json=dados)))
+            resultados[f"POST /resposta [{n}]"] = medir_caso(
+                lambda: verificar(client.post("/resposta", json={
+                    "labirinto": labirinto_id, "grupo": grupo_id, "vertices": caminho
+                })))
+            url_arestas = f"/labirintos/{labirinto_id}/arestas"
+            resultados[f"GET /labirintos/{{id}}/arestas [{n}]"] = medir_caso(
+                lambda: verificar(client.get(url_arestas)),
+                preparar=lambda: main.response_cache.invalidar(("labirinto", labirinto_id)))
+            resultados[f"GET /labirintos/{{id}}/arestas cache [{n}]"] = medir_caso(
+                lambda: verificar(client.get(url_arestas)))
+            resultados[f"WS {MOVIMENTOS_WS} movimentos [{n}]"] = medir_caso(
+                lambda: sessao_ws(client, grupo_id, labirinto_id))
+
+        semear_sessoes(client, ids[tamanhos[0]])
+        resultados["GET /sessoes"] = medir_caso(lambda: verificar(client.get("/sessoes")))
+    return resultados
+
+
+def formatar(valor):
+    if valor is None:
+        return "(ausente)"
+    return " ".join(map(str, valor)) if isinstance(valor, list) else str(valor)
+
+
+def comparar(resultados, baseline, limite, folga, escala=1.0):
+    # Returns the cases slower than the scaled baseline
+    regressoes = []
+    print(f"referencia: maquina {escala:.2f}x a da baseline; tempos base ajustados")
+    print(f"{'caso':<46}{'base (ms)':>12}{'atual (ms)':>12}{'razao':>8}")
+    for caso, atual in resultados.items():
+        base = baseline.get(caso)
+        if base is None:
+            print(f"{caso:<46}{'-':>12}{atual:>12.2f}{'novo':>8}")
+            continue
+        base *= escala
+        razao = atual / base if base else float("inf")
+        # The absolute slack keeps sub-millisecond cases from failing on timer noise
+        marca = "  <- regressao" if atual > base * (1 + limite) + folga else ""
+        print(f"{caso:<46}{base:>12.2f}{atual:>12.2f}{razao:>7.2f}x{marca}")
+        if marca:
+            regressoes.append(caso)
+    return regressoes
+
+
+def rodada_separada(args):
+    # Every case inserts rows, so a second run in this process would measure a bigger database
+    with tempfile.TemporaryDirectory() as diretorio:
+        saida = os.path.join(diretorio, "resultados.json")
+        subprocess.run(
+            [sys.executable, os.path.join(DIRETORIO, os.path.basename(__file__)),
+             "--repeticoes", str(args.repeticoes), "--aquecimento", str(args.aquecimento),
+             "--orcamento", str(args.orcamento), "--tamanhos", *map(str, args.tamanhos),
+             "--resultados", saida],
+            env=AMBIENTE, stdout=subprocess.DEVNULL, check=True
+        )
+        with open(saida) as arquivo:
+            dados = json.load(arquivo)
+    return dados["referencia"], dados["resultados"]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticoes", type=int, default=15, help="rodadas medidas por caso (no maximo)")
+    parser.add_argument("--aquecimento", type=int, default=2, help="rodadas descartadas por caso")
+    parser.add_argument("--orcamento", type=float, default=10.0, help="segundos por caso antes de parar cedo")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS)
+    parser.add_argument("--baseline", default=BASELINE_PADRAO)
+    parser.add_argument("--salvar", action="store_true", help="grava os resultados como baseline")
+    parser.add_argument("--comparar", action="store_true", help="falha se algum caso regredir")
+    parser.add_argument("--limite", type=float, default=0.25, help="regressao tolerada (fracao)")
+    parser.add_argument("--folga", type=float, default=1.0, help="folga absoluta em ms")
+    parser.add_argument("--confirmacoes", type=int, default=2, help="rodadas extras que uma regressao precisa repetir")
+    parser.add_argument("--resultados", help="grava a referencia e os tempos desta rodada em JSON")
+    args = parser.parse_args()
+
+    if args.comparar:
+        with open(args.baseline) as arquivo:
+            salvo = json.load(arquivo)
+        # The fastest of 3 rounds is noisier than the fastest of 15, and every maze is seeded up
+        # front, so a baseline only compares against a run with the same parameters
+        divergentes = [
+            f"--{parametro} {formatar(salvo.get(parametro))} (atual: {formatar(getattr(args, parametro))})"
+            for parametro in PARAMETROS_BASELINE
+            if salvo.get(parametro) != getattr(args, parametro)
+        ]
+        if divergentes:
+            print(f"baseline gravada com {', '.join(divergentes)}; "
+                  "rode com os mesmos parametros ou grave outra com --salvar")
+            sys.exit(2)
+
+    tempo_referencia = medir(referencia, args.repeticoes, args.aquecimento, args.orcamento)
+    resultados = executar(args.repeticoes, args.tamanhos, args.aquecimento, args.orcamento)
+
+    if args.comparar:
+        # Baselines written before the reference existed compare unscaled
+        escala = tempo_referencia / salvo["referencia"] if salvo.get("referencia") else 1.0
+        regressoes = comparar(resultados, salvo["resultados"], args.limite, args.folga, escala)
+        # On a busy machine a slow stretch inflates every round of a case at once; a real
+        # regression shows up again in a fresh run, with its own reference, and noise rarely does
+        for _ in range(args.confirmacoes):
+            if not regressoes:
+                break
+            print(f"confirmando {len(regressoes)} caso(s) em uma nova rodada")
+            referencia_nova, novos = rodada_separada(args)
+            escala = referencia_nova / salvo["referencia"] if salvo.get("referencia") else 1.0
+            confirmados = comparar(novos, salvo["resultados"], args.limite, args.folga, escala)
+            regressoes = [caso for caso in regressoes if caso in confirmados]
+        if regressoes:
+            print(f"{len(regressoes)} caso(s) acima do limite de {args.limite:.0%}")
+            sys.exit(1)
+    else:
+        for caso, tempo in resultados.items():
+            print(f"{caso:<46}{tempo:>12.2f} ms")
+
+    if args.resultados:
+        with open(args.resultados, "w") as arquivo:
+            json.dump({"referencia": tempo_referencia, "resultados": resultados}, arquivo)
+
+    if args.salvar:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as arquivo:
+            json.dump({
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "repeticoes": args.repeticoes,
+                "aquecimento": args.aquecimento,
+                "estatistica": "minimo",
+                "referencia": round(tempo_referencia, 3),
+                "tamanhos": args.tamanhos,
+                "resultados": {caso: round(tempo, 3) for caso, tempo in resultados.items()}
+            }, arquivo, indent=2, ensure_ascii=False)
+            arquivo.write("\n")
+        print(f"baseline gravada em {args.baseline}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,90 @@
+"""Microbenchmark of list serialization: per-row Pydantic DTOs vs the fast path.
+
+Each endpoint is measured twice over the same synthetic rows:
+- antigo: builds one DTO per row and renders it the way FastAPI does for a
+  plain return value (jsonable_encoder + JSONResponse)
+- rapido: builds dicts straight from query tuples and renders them with
+  FastJSONResponse (orjson, no re-validation)
+
+Usage: python benchmarks/bench_serializacao.py [--linhas 10000] [--repeticoes 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+os.chdir(tempfile.mkdtemp())  # Keep the module-level SQLite file out of the repo
+
+import main  # noqa: E402
+
+
+def linhas_grupos(n):
+    return [(uuid.uuid4(), f"Grupo {i}", ",".join(str(j) for j in range(i % 8))) for i in range(n)]
+
+
+def linhas_labirintos(n):
+    return [(i, "Intermediario") for i in range(n)]
+
+
+def grupos_antigo(linhas):
+    dtos = [main.GrupoDto(
+        id=grupo_id,
+        nome=nome,
+        labirintos_concluidos=concluidos.split(",") if concluidos else []
+    ) for grupo_id, nome, concluidos in linhas]
+    return JSONResponse(jsonable_encoder({"Grupos": dtos})).body
+
+
+def grupos_rapido(linhas):
+    return main.FastJSONResponse({"Grupos": [main.grupo_dto(*linha) for linha in linhas]}).body
+
+
+def labirintos_antigo(linhas):
+    dtos = [main.RetornaLabirintosDto(labirinto=lab_id, dificuldade=dificuldade) for lab_id, dificuldade in linhas]
+    return JSONResponse(jsonable_encoder({"labirintos": dtos})).body
+
+
+def labirintos_rapido(linhas):
+    return main.FastJSONResponse({"labirintos": [
+        {"labirinto": lab_id, "dificuldade": dificuldade} for lab_id, dificuldade in linhas
+    ]}).body
+
+
+CASOS = {
+    "/grupos": (linhas_grupos, grupos_antigo, grupos_rapido),
+    "/labirintos": (linhas_labirintos, labirintos_antigo, labirintos_rapido),
+}
+
+
+def medir(funcao, linhas, repeticoes):
+    return min(timeit.repeat(lambda: funcao(linhas), number=1, repeat=repeticoes))
+
+
+def orjson_loads(corpo):
+    return main.orjson.loads(corpo)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=10000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<14}{'antigo (ms)':>14}{'rapido (ms)':>14}{'ganho':>9}")
+    for endpoint, (gerar_linhas, antigo, rapido) in CASOS.items():
+        linhas = gerar_linhas(args.linhas)
+        # Both paths must produce the same document
+        assert orjson_loads(antigo(linhas)) == orjson_loads(rapido(linhas))
+        t_antigo = medir(antigo, linhas, args.repeticoes)
+        t_rapido = medir(rapido, linhas, args.repeticoes)
+        print(f"{endpoint:<14}{t_antigo * 1000:>14.2f}{t_rapido * 1000:>14.2f}{t_antigo / t_rapido:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,289 @@
+"""Replay traffic recorded by the API (GRAVACAO_ARQUIVO) against a running server.
+
+Usage:
+    python benchmarks/replay_trafego.py trafego.jsonl [--url http://localhost:8000] [--velocidade 1.0]
+    python benchmarks/replay_trafego.py trafego.jsonl --velocidade 0     # as fast as causality allows
+
+Every HTTP request and websocket connection starts at its recorded offset
+divided by --velocidade. Ordering is kept deterministic regardless of speed:
+- a request or connection waits for every HTTP exchange that had finished
+  before it started in the recording
+- inside a connection, a client frame waits until the server has sent as many
+  frames as it had sent before that frame in the recording (up to --espera seconds)
+
+Ids created during the recording (groups, mazes, sessions, jobs) are mapped to
+the ones the local server returns, by comparing recorded and replayed JSON
+responses, and rewritten in later paths, queries, bodies and frames. Start the
+local server from a copy of the database taken when the recording began.
+
+Requests whose body was recorded only as a hash (GRAVACAO_PAYLOADS=0 or above
+GRAVACAO_MAX_CORPO) are skipped. The report lists latency percentiles per
+route, status codes that differ from the recording and websocket frame counts.
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from websockets.asyncio.client import connect
+
+# Response keys whose values identify an entity, and the kind of id they carry
+CHAVES_ID = {
+    "GrupoId": "grupo",
+    "grupo_id": "grupo",
+    "LabirintoId": "labirinto",
+    "labirinto": "labirinto",
+    "labirinto_id": "labirinto",
+    "session_id": "sessao",
+    "job_id": "job"
+}
+# Path segment that precedes an integer id of each kind
+SEGMENTOS_ID = {"labirintos": "labirinto", "session-histories": "labirinto", "sessoes": "sessao"}
+UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+class MapaIds:
+    def __init__(self):
+        # Format: {id gravado (str): id local (str)} for uuids and job ids
+        self.textos = {}
+        # Format: {tipo: {id gravado (int): id local (int)}}
+        self.inteiros = defaultdict(dict)
+
+    def aprender(self, gravado, local, tipo=None):
+        # Walks both responses in parallel; only values under CHAVES_ID (or uuids) are mapped
+        if isinstance(gravado, dict) and isinstance(local, dict):
+            for chave, valor in gravado.items():
+                if chave in local:
+                    self.aprender(valor, local[chave], CHAVES_ID.get(chave))
+        elif isinstance(gravado, list) and isinstance(local, list):
+            for valor_gravado, valor_local in zip(gravado, local):
+                self.aprender(valor_gravado, valor_local, tipo)
+        elif gravado != local:
+            if isinstance(gravado, str) and isinstance(local, str) and (tipo or UUID.match(gravado)):
+                self.textos[gravado] = local
+            elif isinstance(gravado, int) and isinstance(local, int) and tipo:
+                self.inteiros[tipo][gravado] = local
+
+    def inteiro(self, tipo: str, valor: str) -> str:
+        if not valor.isdigit():
+            return self.textos.get(valor, valor)
+        return str(self.inteiros[tipo].get(int(valor), int(valor)))
+
+    def caminho(self, caminho: str) -> str:
+        partes = caminho.split("/")
+        for i, parte in enumerate(partes):
+            anterior = partes[i - 1] if i else ""
+            if anterior in SEGMENTOS_ID:
+                partes[i] = self.inteiro(SEGMENTOS_ID[anterior], parte)
+            elif i == 3 and partes[1] == "ws":
+                partes[i] = self.inteiro("labirinto", parte)  # /ws/{grupo_id}/{labirinto_id}
+            else:
+                partes[i] = self.textos.get(parte, parte)
+        return "/".join(partes)
+
+    def query(self, query: str) -> str:
+        if not query:
+            return query
+        pares = []
+        for par in query.split("&"):
+            chave, _, valor = par.partition("=")
+            tipo = CHAVES_ID.get(chave)
+            valor = self.inteiro(tipo, valor) if tipo else self.textos.get(valor, valor)
+            pares.append(f"{chave}={valor}")
+        return "&".join(pares)
+
+    def json(self, valor, tipo=None):
+        if isinstance(valor, dict):
+            return {chave: self.json(item, CHAVES_ID.get(chave)) for chave, item in valor.items()}
+        if isinstance(valor, list):
+            return [self.json(item, tipo) for item in valor]
+        if isinstance(valor, str):
+            return self.textos.get(valor, valor)
+        if isinstance(valor, int) and not isinstance(valor, bool) and tipo:
+            return self.inteiros[tipo].get(valor, valor)
+        return valor
+
+    def corpo(self, texto: str) -> str:
+        try:
+            return json.dumps(self.json(json.loads(texto)))
+        except ValueError:
+            return self.textos.get(texto, texto)
+
+
+def carregar(arquivo: str):
+    http, conexoes = [], defaultdict(list)
+    with open(arquivo) as entrada:
+        for linha in entrada:
+            evento = json.loads(linha)
+            if evento["tipo"] == "http":
+                http.append(evento)
+            elif evento["tipo"].startswith("ws_"):
+                conexoes[evento["c"]].append(evento)
+    http.sort(key=lambda evento: evento["t"])
+    websockets = sorted(
+        (eventos for eventos in conexoes.values() if eventos[0]["tipo"] == "ws_abrir"),
+        key=lambda eventos: eventos[0]["t"]
+    )
+    return http, websockets
+
+
+def rota(metodo: str, caminho: str) -> str:
+    partes = ["{id}" if parte.isdigit() or UUID.match(parte) else parte for parte in caminho.split("/")]
+    return f"{metodo} {'/'.join(partes)}"
+
+
+class Replay:
+    def __init__(self, url: str, velocidade: float, espera: float):
+        self.url = url.rstrip("/")
+        self.url_ws = re.sub(r"^http", "ws", self.url)
+        self.velocidade = velocidade
+        self.espera = espera
+        self.mapa = MapaIds()
+        # Format: [(fim gravado, task)] of HTTP exchanges already dispatched
+        self.em_voo = []
+        self.latencias = defaultdict(list)
+        self.divergencias = defaultdict(int)
+        self.ignorados = 0
+        self.ws = {"conexoes": 0, "enviados": 0, "recebidos": 0, "recebidos_gravados": 0}
+
+    async def aguardar_instante(self, t: float):
+        if self.velocidade > 0:
+            atraso = self.inicio + t / self.velocidade - time.monotonic()
+            if atraso > 0:
+                await asyncio.sleep(atraso)
+        # Exchanges that finished before t in the recording must finish first here too
+        anteriores = [tarefa for fim, tarefa in self.em_voo if fim <= t]
+        if anteriores:
+            await asyncio.gather(*anteriores)
+
+    async def http(self, cliente: httpx.AsyncClient, evento: dict):
+        requisicao = evento["requisicao"]
+        if requisicao["tamanho"] and "texto" not in requisicao:
+            self.ignorados += 1
+            return
+        caminho = self.mapa.caminho(evento["caminho"])
+        query = self.mapa.query(evento["query"])
+        corpo = self.mapa.corpo(requisicao["texto"]) if requisicao["tamanho"] else None
+        cabecalhos = {"content-type": evento["conteudo"]} if evento.get("conteudo") else {}
+        inicio = time.perf_counter()
+        resposta = await cliente.request(
+            evento["metodo"], f"{caminho}?{query}" if query else caminho, content=corpo, headers=cabecalhos
+        )
+        chave = rota(evento["metodo"], evento["caminho"])
+        self.latencias[chave].append((time.perf_counter() - inicio) * 1000)
+        if resposta.status_code != evento["status"]:
+            self.divergencias[f"{chave} {evento['status']} -> {resposta.status_code}"] += 1
+        texto = evento["resposta"].get("texto")
+        if texto and resposta.headers.get("content-type", "").startswith("application/json"):
+            try:
+                self.mapa.aprender(json.loads(texto), resposta.json())
+            except ValueError:
+                pass
+
+    async def websocket(self, eventos: list):
+        abertura = eventos[0]
+        caminho = self.mapa.caminho(abertura["caminho"])
+        query = self.mapa.query(abertura["query"])
+        recebidos = 0
+        esperados = 0
+        novo_frame = asyncio.Event()
+
+        async def ler(conexao):
+            nonlocal recebidos
+            async for _ in conexao:
+                recebidos += 1
+                novo_frame.set()
+
+        async def alcancar_servidor():
+            limite = time.monotonic() + self.espera
+            while recebidos < esperados and time.monotonic() < limite:
+                novo_frame.clear()
+                try:
+                    await asyncio.wait_for(novo_frame.wait(), limite - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+
+        self.ws["conexoes"] += 1
+        inicio = time.perf_counter()
+        try:
+            async with connect(f"{self.url_ws}{caminho}{'?' + query if query else ''}") as conexao:
+                leitor = asyncio.create_task(ler(conexao))
+                for evento in eventos[1:]:
+                    if evento["tipo"] == "ws_servidor":
+                        esperados += 1
+                        continue
+                    await self.aguardar_instante(evento["t"])
+                    await alcancar_servidor()
+                    if evento["tipo"] == "ws_fechar":
+                        break
+                    if "texto" not in evento:
+                        self.ignorados += 1
+                        continue
+                    await conexao.send(self.mapa.corpo(evento["texto"]))
+                    self.ws["enviados"] += 1
+                leitor.cancel()
+        except Exception as erro:
+            self.divergencias[f"WS {rota('', abertura['caminho']).strip()} {type(erro).__name__}"] += 1
+        self.latencias[f"WS {rota('', abertura['caminho']).strip()}"].append((time.perf_counter() - inicio) * 1000)
+        self.ws["recebidos"] += recebidos
+        self.ws["recebidos_gravados"] += esperados
+
+    async def executar(self, http: list, websockets: list):
+        self.inicio = time.monotonic()
+        # One timeline, so connections also wait for the exchanges that preceded them
+        linha_do_tempo = sorted(
+            [(evento["t"], 0, evento) for evento in http] + [(eventos[0]["t"], 1, eventos) for eventos in websockets],
+            key=lambda item: item[:2]
+        )
+        conexoes = []
+        async with httpx.AsyncClient(base_url=self.url, timeout=None) as cliente:
+            for t, tipo, dados in linha_do_tempo:
+                await self.aguardar_instante(t)
+                if tipo:
+                    conexoes.append(asyncio.create_task(self.websocket(dados)))
+                else:
+                    tarefa = asyncio.create_task(self.http(cliente, dados))
+                    self.em_voo.append((t + dados["duracao"], tarefa))
+            await asyncio.gather(*(tarefa for _, tarefa in self.em_voo), *conexoes)
+        return time.monotonic() - self.inicio
+
+
+def percentil(valores: list, fracao: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(fracao * len(ordenados)))]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("arquivo")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--velocidade", type=float, default=1.0, help="multiplicador de tempo; 0 = sem pausas")
+    parser.add_argument("--espera", type=float, default=5.0, help="segundos aguardando respostas do websocket")
+    args = parser.parse_args()
+
+    http, websockets = carregar(args.arquivo)
+    replay = Replay(args.url, args.velocidade, args.espera)
+    duracao = asyncio.run(replay.executar(http, websockets))
+
+    print(f"{len(http)} requisições e {len(websockets)} websockets em {duracao:.2f}s "
+          f"({replay.ignorados} sem corpo gravado ignorados)")
+    print(f"{'rota':<52}{'n':>6}{'p50 (ms)':>11}{'p95 (ms)':>11}{'max (ms)':>11}")
+    for chave, valores in sorted(replay.latencias.items()):
+        print(f"{chave:<52}{len(valores):>6}{statistics.median(valores):>11.2f}"
+              f"{percentil(valores, 0.95):>11.2f}{max(valores):>11.2f}")
+    print(f"frames websocket: {replay.ws['enviados']} enviados, {replay.ws['recebidos']} recebidos "
+          f"({replay.ws['recebidos_gravados']} na gravação)")
+    if replay.divergencias:
+        print("divergências:")
+        for chave, quantidade in sorted(replay.divergencias.items()):
+            print(f"  {chave}: {quantidade}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
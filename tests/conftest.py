@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main reads its configuration on import, so the environment is set up first
+DIRETORIO = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DIRETORIO}/testes.sqlite3"
+os.environ["SNAPSHOT_DIR"] = os.path.join(DIRETORIO, "snapshots")
+os.environ["WARMUP_LABIRINTOS"] = "0"
+os.environ["COMPACTACAO_INTERVALO"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+LABIRINTO = {
+    "dificuldade": "teste",
+    "vertices": [{"id": i, "tipo": tipo} for i, tipo in enumerate([1, 0, 0, 2])],
+    "arestas": [
+        {"origemId": origem, "destinoId": destino, "peso": 1}
+        for origem, destino in [(0, 1), (1, 0), (1, 2), (2, 1), (2, 3), (3, 2)]
+    ]
+}
+
+
+@pytest.fixture
+def client():
+    # The lifespan drains the app on exit; each test starts from a running one
+    main.desligamento.encerrando = False
+    main.live_feed.encerrado = False
+    with TestClient(main.app) as cliente:
+        yield cliente
+
+
+@pytest.fixture
+def grupo_id(client):
+    return client.post("/grupo", json={"nome": "testes"}).json()["GrupoId"]
@@ -0,0 +1,35 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from conftest import LABIRINTO
+
+
+def test_edicoes_concorrentes_nao_travam_o_banco(client, monkeypatch):
+    labirinto_id = client.post("/labirinto", json=LABIRINTO).json()["LabirintoId"]
+    editar_snapshot = main.editar_snapshot
+
+    def editar_snapshot_lento(*args):
+        # Keeps the first edit inside its snapshot rewrite while the other requests arrive
+        time.sleep(0.3)
+        return editar_snapshot(*args)
+
+    monkeypatch.setattr(main, "editar_snapshot", editar_snapshot_lento)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        primeira = executor.submit(
+            client.patch, f"/labirintos/{labirinto_id}/vertices", json={"adicionar": [{"id": 4, "tipo": 0}]}
+        )
+        time.sleep(0.1)
+        segunda = executor.submit(
+            client.patch, f"/labirintos/{labirinto_id}/arestas",
+            json={"adicionar": [{"origemId": 3, "destinoId": 0, "peso": 2}]}
+        )
+        time.sleep(0.1)
+        grupo = executor.submit(client.post, "/grupo", json={"nome": "concorrente"})
+        respostas = [primeira.result(), segunda.result(), grupo.result()]
+
+    assert [resposta.status_code for resposta in respostas] == [200, 200, 200]
+    assert sorted(resposta.json()["versao"] for resposta in respostas[:2]) == [2, 3]
+    grafo = main.grafos.obter(labirinto_id)
+    assert grafo.contem(4)
+    assert (0, 2) in grafo.adjacentes(3)
@@ -0,0 +1,88 @@
+import time
+from uuid import UUID
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+import main
+from conftest import LABIRINTO
+
+
+def esperar_liberacao(prazo=2.0):
+    # The client sees the close frame before the server task has run its finally block
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if not main.admissao.sessoes_grupo and main.admissao.vagas._value == main.MAX_CONEXOES:
+            return
+        time.sleep(0.01)
+
+
+def test_falha_no_commit_libera_admissao(client, grupo_id):
+    labirinto_id = client.post("/labirinto", json=LABIRINTO).json()["LabirintoId"]
+
+    def falhar(sessao, contexto, instancias):
+        if any(isinstance(objeto, main.MovementLog) for objeto in sessao.new):
+            raise SQLAlchemyError("falha simulada no commit")
+
+    event.listen(main.SessionLocal, "before_flush", falhar)
+    try:
+        with pytest.raises(SQLAlchemyError):
+            with client.websocket_connect(f"/ws/{grupo_id}/{labirinto_id}") as websocket:
+                websocket.receive_text()
+                websocket.send_text("ir:1")
+                websocket.receive_text()
+    finally:
+        event.remove(main.SessionLocal, "before_flush", falhar)
+
+    esperar_liberacao()
+    assert main.admissao.sessoes_grupo == {}
+    assert main.admissao.sessoes_labirinto == {}
+    assert main.admissao.vagas._value == main.MAX_CONEXOES
+    db = main.SessionLocal()
+    try:
+        estados = {estado for estado, in db.query(main.SessaoWebSocket.estado).filter_by(grupo_id=UUID(grupo_id))}
+    finally:
+        db.close()
+    assert estados == {"desconectada"}
+
+
+def test_sessao_invalida_libera_admissao(client, grupo_id):
+    labirinto_id = client.post("/labirinto", json=LABIRINTO).json()["LabirintoId"]
+    with pytest.raises(Exception):
+        with client.websocket_connect(f"/ws/{grupo_id}/{labirinto_id}?session_id=999999") as websocket:
+            websocket.receive_text()
+
+    esperar_liberacao()
+    assert main.admissao.sessoes_grupo == {}
+    assert main.admissao.sessoes_labirinto == {}
+    assert main.admissao.vagas._value == main.MAX_CONEXOES
+
+
+def test_historico_comeca_na_entrada(client, grupo_id):
+    labirinto = {
+        "dificuldade": "teste",
+        "entrada": 5,
+        "vertices": {"ids": [5, 6, 7], "tipos": [1, 0, 2]},
+        "arestas": {"origens": [5, 6, 6, 7], "destinos": [6, 5, 7, 6], "pesos": [1, 1, 1, 1]}
+    }
+    labirinto_id = client.post("/labirinto/colunar", json=labirinto).json()["LabirintoId"]
+    with client.websocket_connect(f"/ws/{grupo_id}/{labirinto_id}") as websocket:
+        websocket.receive_text()
+        websocket.send_text("ir:6")
+        websocket.receive_text()
+    esperar_liberacao()
+
+    historicos = client.get(f"/session-histories/{labirinto_id}/pagina").json()["histories"]
+    assert [historico["deltas"] for historico in historicos] == [[5, 1]]
+
+    job_id = client.post(f"/admin/recorrigir?labirinto_id={labirinto_id}").json()["job_id"]
+    limite = time.monotonic() + 10
+    while (job := client.get(f"/jobs/{job_id}").json())["estado"] not in ("concluido", "falhou"):
+        assert time.monotonic() < limite
+        time.sleep(0.05)
+    assert job["estado"] == "concluido"
+
+    historicos = client.get(f"/session-histories/{labirinto_id}/pagina").json()["histories"]
+    assert historicos[0]["valido"] is True
+    assert historicos[0]["chegou_saida"] is False